@@ -0,0 +1,340 @@
+import os
+import re
+import json
+import argparse
+import itertools
+import functools
+import pandas as pd
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict
+
+from data import HoldetDk, ApiFootball, Stats, TEAM_ID_MAP, EVENTS
+from optimization import Optimization, OptimizationInput
+
+# A recorded round is stored as one JSON file, `round_<number>.json`, in a rounds directory:
+#   {
+#     "round": 3,
+#     "holdet": {"game_id": ..., "game": ..., "tournament": ..., "ruleset": ..., "round_stats": [...]},
+#     "api_football": {"league_id": ..., "season": ..., "bookmaker": ..., "fixtures": [...], "odds": {...},
+#                      "predictions": {...}, "injuries": [...]},
+#     "realized_points": {"<player_id>": points, ...}
+#   }
+# "realized_points" is optional. In Holdet the points of a round equal the player value growth, so if it is missing,
+# the realized points are read from the growth values in the statistics of the following recorded round.
+
+ROUND_FILE_PATTERN = re.compile(r"^round_(\d+)\.json$")
+
+HOLDET_START_BUDGET = 50_000_000
+"""Cash holding of a new Holdet team."""
+
+
+class RecordedHoldetDk(HoldetDk):
+    """HoldetDk data loaded from a recorded round instead of https://www.holdet.dk/da."""
+
+    def __init__(self, recorded: dict, round_number: int):
+        self.recorded = recorded
+        self.round_number = round_number
+        super().__init__(game_id=recorded['game_id'])
+
+    def get_game_data(self) -> dict:
+        return self.recorded['game']
+
+    def get_tournament_data(self) -> dict:
+        return self.recorded['tournament']
+
+    def get_ruleset_data(self) -> dict:
+        return self.recorded['ruleset']
+
+    def get_current_round(self) -> int:
+        return self.round_number
+
+    def get_current_round_stats(self) -> dict:
+        return self.recorded['round_stats']
+
+
+class RecordedApiFootball(ApiFootball):
+    """ApiFootball data loaded from a recorded round instead of https://www.api-football.com/."""
+
+    def __init__(self, recorded: dict):
+        self.recorded = recorded
+        super().__init__(
+            api_key="",
+            league_id=recorded['league_id'],
+            season=recorded['season'],
+            bookmaker=recorded['bookmaker']
+        )
+
+    def _get_fixtures(self):
+        return self.recorded['fixtures']
+
+    def get_injuries(self):
+        return self.recorded['injuries']
+
+    def get_odds(self, bet_ids: List[int], earliest_fixture_time_utc: dt.datetime = None,
+                 latest_fixture_time_utc: dt.datetime = None) -> Dict[int, List[Dict]]:
+        return {bet_id: self.recorded['odds'].get(bet_id, []) for bet_id in bet_ids}
+
+    def get_fixture_predictions(self, earliest_fixture_time_utc: dt.datetime = None,
+                                latest_fixture_time_utc: dt.datetime = None) -> Dict:
+        return self.recorded['predictions']
+
+
+class BacktestConfig:
+    """A parameter set to backtest: optimization factor weights and model parameters."""
+
+    def __init__(
+            self,
+            weight_team_win: float = 1,
+            weight_player_goals: float = 1,
+            weight_player_assists: float = 1,
+            weight_player_cards: float = 1,
+            weight_player_clean_sheets: float = 1,
+            min_prob_appear: float = 0.80,
+            min_spend_portion: float = 0.95,
+            transfer_cost_rate: float = 0.01,
+            max_seconds: float = 30,
+            initial_cash: float = HOLDET_START_BUDGET
+    ):
+        self.weight_team_win = weight_team_win
+        self.weight_player_goals = weight_player_goals
+        self.weight_player_assists = weight_player_assists
+        self.weight_player_cards = weight_player_cards
+        self.weight_player_clean_sheets = weight_player_clean_sheets
+        self.min_prob_appear = min_prob_appear
+        self.min_spend_portion = min_spend_portion
+        self.transfer_cost_rate = transfer_cost_rate
+        self.max_seconds = max_seconds
+        self.initial_cash = initial_cash
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def param_grid(**param_values: list) -> List[BacktestConfig]:
+    """Return a config for each combination of the given parameter values, e.g.
+    param_grid(min_prob_appear=[0.7, 0.8], weight_team_win=[0.5, 1])."""
+
+    keys = list(param_values.keys())
+    return [BacktestConfig(**dict(zip(keys, values))) for values in itertools.product(*param_values.values())]
+
+
+def record_round(holdet: HoldetDk, api_football: ApiFootball, rounds_dir: str) -> str:
+    """Store the current round of live HoldetDk and ApiFootball data for later backtesting. Returns the file path."""
+
+    round_number = holdet.get_current_round()
+    round_start, round_end = holdet.current_round_start_end_time
+    recorded = {
+        "round": round_number,
+        "holdet": {
+            "game_id": holdet.game_id,
+            "game": holdet.game_data,
+            "tournament": holdet.tournament_data,
+            "ruleset": holdet.ruleset_data,
+            "round_stats": holdet.get_current_round_stats(),
+        },
+        "api_football": {
+            "league_id": api_football.league_id,
+            "season": api_football.season,
+            "bookmaker": api_football.bookmaker,
+            "fixtures": api_football.fixtures,
+            "odds": api_football.get_odds(
+                bet_ids=list(set([event['bet_id'] for i, event in EVENTS.items()])),
+                earliest_fixture_time_utc=round_start,
+                latest_fixture_time_utc=round_end
+            ),
+            "predictions": api_football.get_fixture_predictions(
+                earliest_fixture_time_utc=round_start,
+                latest_fixture_time_utc=round_end
+            ),
+            "injuries": api_football.get_injuries(),
+        },
+    }
+    os.makedirs(rounds_dir, exist_ok=True)
+    path = os.path.join(rounds_dir, f"round_{round_number}.json")
+    with open(path, "w") as f:
+        json.dump(recorded, f)
+    return path
+
+
+def get_round_paths(rounds_dir: str) -> List[str]:
+    """Return the recorded round files in a directory, ordered by round number."""
+
+    rounds = [
+        (int(match.group(1)), os.path.join(rounds_dir, file_name))
+        for file_name in os.listdir(rounds_dir)
+        for match in [ROUND_FILE_PATTERN.match(file_name)] if match
+    ]
+    return [path for _, path in sorted(rounds)]
+
+
+def load_round(path: str) -> (RecordedHoldetDk, RecordedApiFootball):
+    """Load a recorded round."""
+
+    with open(path) as f:
+        recorded = json.load(f)
+    api_football_data = recorded['api_football']
+    # JSON object keys are strings, but the odds are keyed by bet ID and the predictions by fixture ID.
+    api_football_data['odds'] = {int(bet_id): odds for bet_id, odds in api_football_data['odds'].items()}
+    api_football_data['predictions'] = {
+        int(fixture_id): prediction for fixture_id, prediction in api_football_data['predictions'].items()
+    }
+    return (
+        RecordedHoldetDk(recorded['holdet'], recorded['round']),
+        RecordedApiFootball(api_football_data)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _load_round(path: str) -> (RecordedHoldetDk, RecordedApiFootball):
+    """Load a recorded round. Cached per process, so every config run by a worker shares the parsed round."""
+
+    return load_round(path)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_realized_points(path: str, next_path: str | None) -> Dict[int, float]:
+    """Return realized points by player_id for a recorded round."""
+
+    with open(path) as f:
+        recorded = json.load(f)
+    if recorded.get('realized_points') is not None:
+        return {int(player_id): points for player_id, points in recorded['realized_points'].items()}
+    if next_path is None:
+        return {}
+    with open(next_path) as f:
+        next_recorded = json.load(f)
+    return {
+        player['player']['id']: player['values']['growth'] for player in next_recorded['holdet']['round_stats']
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def _load_stats() -> Stats:
+    return Stats()
+
+
+def _run_rounds(config: BacktestConfig, round_paths: List[str], next_paths: List[str | None],
+                config_idx: int) -> List[dict]:
+    """Replay rounds in order for a single config, carrying the squad and cash over from round to round."""
+
+    squad = []
+    cash = config.initial_cash
+    rows = []
+    for path, next_path in zip(round_paths, next_paths):
+        holdet, api_football = _load_round(path)
+        optimization_input = OptimizationInput(
+            holdet=holdet,
+            api_football=api_football,
+            stats=_load_stats(),
+            existing_player_ids=squad,
+            bank_beholdning=cash,
+            weight_team_win=config.weight_team_win,
+            weight_player_goals=config.weight_player_goals,
+            weight_player_assists=config.weight_player_assists,
+            weight_player_cards=config.weight_player_cards,
+            weight_player_clean_sheets=config.weight_player_clean_sheets,
+            team_id_map=TEAM_ID_MAP,
+            events=EVENTS
+        )
+        optimization = Optimization(
+            optimization_input,
+            min_prob_appear=config.min_prob_appear,
+            min_spend_portion=config.min_spend_portion,
+            transfer_cost_rate=config.transfer_cost_rate,
+            max_seconds=config.max_seconds
+        )
+        optimization.build_model()
+        optimization.run()
+        budget = optimization_input.get_budget()
+        if optimization.model.num_solutions == 0:
+            # No feasible team, so the squad is kept as is.
+            selected_player_ids = squad
+            expected_score = None
+        else:
+            result = optimization.get_result()
+            selected_player_ids = result['selected_player_ids']
+            expected_score = result['expected_score']
+        players = optimization_input.players
+        current_value = players.column('current_value')
+        bought = [player_id for player_id in selected_player_ids if player_id not in squad]
+        transfer_costs = current_value[players.indices_of(bought)].sum() * config.transfer_cost_rate
+        team_value = current_value[players.indices_of(selected_player_ids)].sum()
+        cash = budget - team_value - transfer_costs
+        realized_points = _load_realized_points(path, next_path)
+        rows.append({
+            "config": config_idx,
+            "round": holdet.round_number,
+            "expected_score": expected_score,
+            "realized_points": sum(realized_points.get(player_id, 0) for player_id in selected_player_ids),
+            "transfers": len(bought),
+            "transfer_costs": transfer_costs,
+            "team_value": team_value,
+            "cash": cash,
+            "selected_player_ids": selected_player_ids,
+        })
+        squad = selected_player_ids
+    return rows
+
+
+def run_backtest(
+        rounds_dir: str,
+        configs: List[BacktestConfig],
+        carry_over: bool = True,
+        max_workers: int = None
+) -> pd.DataFrame:
+    """Replay all recorded rounds in `rounds_dir` for every config and return one row per config and round.
+
+    With `carry_over` each config starts from an empty squad and carries its squad and cash from round to round, so
+    the rounds of a config run in order while the configs run in parallel. Without `carry_over` every round is solved
+    from an empty squad with the initial cash, and all (config, round) pairs run in parallel.
+    """
+
+    round_paths = get_round_paths(rounds_dir)
+    if len(round_paths) == 0:
+        raise Exception(f"No recorded rounds found in {rounds_dir}.")
+    next_paths = round_paths[1:] + [None]
+    if carry_over:
+        jobs = [(config, round_paths, next_paths, i) for i, config in enumerate(configs)]
+    else:
+        jobs = [
+            (config, [path], [next_path], i)
+            for i, config in enumerate(configs)
+            for path, next_path in zip(round_paths, next_paths)
+        ]
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_run_rounds, *job) for job in jobs]
+        for future in as_completed(futures):
+            rows.extend(future.result())
+    results = pd.DataFrame(rows).sort_values(by=['config', 'round']).reset_index(drop=True)
+    return results
+
+
+def summarize(results: pd.DataFrame, configs: List[BacktestConfig]) -> pd.DataFrame:
+    """Return total realized points per config, best config first."""
+
+    totals = results.groupby('config').agg(
+        realized_points=('realized_points', 'sum'),
+        transfers=('transfers', 'sum'),
+        transfer_costs=('transfer_costs', 'sum'),
+    )
+    params = pd.DataFrame([config.to_dict() for config in configs])
+    return totals.join(params).sort_values(by='realized_points', ascending=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest optimization parameters on recorded Holdet rounds.")
+    parser.add_argument("rounds_dir", help="Directory with recorded round_<number>.json files.")
+    parser.add_argument("--grid", default="{}",
+                        help='JSON object of parameter value lists, e.g. \'{"min_prob_appear": [0.7, 0.8]}\'.')
+    parser.add_argument("--no-carry-over", action="store_true", help="Solve every round from an empty squad.")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    backtest_configs = param_grid(**json.loads(args.grid))
+    backtest_results = run_backtest(
+        args.rounds_dir, backtest_configs, carry_over=not args.no_carry_over, max_workers=args.workers
+    )
+    print(summarize(backtest_results, backtest_configs).to_string())
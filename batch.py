@@ -0,0 +1,178 @@
+import os
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List
+
+from data import GAMES, DEFAULT_GAME
+from context import RoundContext
+from optimization import Optimization
+
+WEIGHT_FIELDS = [
+    'weight_team_win',
+    'weight_player_goals',
+    'weight_player_assists',
+    'weight_player_cards',
+    'weight_player_clean_sheets',
+]
+"""Optimization factor weights of a squad, 1 unless given."""
+
+RESULT_FIELDS = [
+    'squad_index',
+    'selected_player_ids',
+    'formation',
+    'expected_score',
+    'players_total_value',
+    'error',
+    'seconds',
+]
+"""Fields added to each squad in the results."""
+
+_context = None
+"""Round context of the batch, inherited by the forked worker processes."""
+
+_scored_players = {}
+"""Scored players of the batch by weights, inherited by the forked worker processes. Kept by the batch, as the round
+context only caches the scored players of a few weights."""
+
+
+def read_squads(path: str) -> List[dict]:
+    """Read squads from a JSONL file, one JSON object per line with existing_player_ids (default none), bank_beholdning
+    and optionally the weights of WEIGHT_FIELDS. Other fields, e.g. a manager name, are passed through to the
+    results."""
+
+    squads = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            squad = json.loads(line)
+            if 'bank_beholdning' not in squad:
+                raise Exception(f"Squad on line {line_number} of {path} has no bank_beholdning.")
+            squad['existing_player_ids'] = [int(player_id) for player_id in squad.get('existing_player_ids', [])]
+            if len(squad['existing_player_ids']) not in (0, 11):
+                raise Exception(f"Squad on line {line_number} of {path} must have 0 or 11 existing players.")
+            for field in WEIGHT_FIELDS:
+                squad.setdefault(field, 1)
+            squads.append(squad)
+    return squads
+
+
+def _solve_squad(squad_index: int, squad: dict, settings: dict, injuries: list) -> dict:
+    start = time.perf_counter()
+    result = {'squad_index': squad_index, 'error': None}
+    try:
+        optimization_input = _context.get_optimization_input(
+            existing_player_ids=squad['existing_player_ids'],
+            bank_beholdning=squad['bank_beholdning'],
+            **{field: squad[field] for field in WEIGHT_FIELDS},
+            injuries=injuries,
+            players=_scored_players[tuple(squad[field] for field in WEIGHT_FIELDS)]
+        )
+        optimization = Optimization(optimization_input, **settings)
+        optimization.build_model()
+        optimization.run()
+        if optimization.model.num_solutions == 0:
+            raise Exception("No feasible team found.")
+        optimization_result = optimization.get_result()
+        result.update({
+            'selected_player_ids': optimization_result['selected_player_ids'],
+            'formation': optimization_result['formation'],
+            'expected_score': optimization_result['expected_score'],
+            'players_total_value': int(optimization_result['players_total_value']),
+        })
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - start
+    return {**squad, **result}
+
+
+def run_batch(
+        context: RoundContext,
+        squads: List[dict],
+        output_path: str,
+        settings: dict = None,
+        max_workers: int = None
+) -> dict:
+    """Solve every squad against one round context in a process pool, writing the results to output_path (CSV if it
+    ends with .csv, else JSONL) as they finish. The players are scored once per distinct set of weights and the
+    injuries fetched once, before the worker processes are forked, so the workers only build and solve the models.
+    Returns the number of squads and errors, the run time and the throughput in squads per second."""
+
+    global _context, _scored_players
+    _context = context
+    settings = settings or {}
+    injuries = context.api_football.get_injuries()
+    _scored_players = {
+        weights: context.get_optimization_input(
+            existing_player_ids=[], bank_beholdning=0, **dict(zip(WEIGHT_FIELDS, weights)), injuries=injuries
+        ).players
+        for weights in dict.fromkeys(tuple(squad[field] for field in WEIGHT_FIELDS) for squad in squads)
+    }
+
+    start = time.perf_counter()
+    errors = 0
+    is_csv = output_path.endswith('.csv')
+    with open(output_path, 'w', newline='') as f:
+        if is_csv:
+            fields = list(dict.fromkeys([field for squad in squads for field in squad] + RESULT_FIELDS))
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+        # The round context is inherited by forking, instead of being pickled for every squad.
+        with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = [
+                executor.submit(_solve_squad, squad_index, squad, settings, injuries)
+                for squad_index, squad in enumerate(squads)
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                errors += result['error'] is not None
+                if is_csv:
+                    writer.writerow({
+                        field: json.dumps(value) if isinstance(value, (list, dict)) else value
+                        for field, value in result.items()
+                    })
+                else:
+                    f.write(json.dumps(result) + '\n')
+                f.flush()
+    seconds = time.perf_counter() - start
+    return {
+        'squads': len(squads),
+        'errors': errors,
+        'seconds': seconds,
+        'squads_per_second': len(squads) / seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommend teams for many squads, e.g. all managers of a league.")
+    parser.add_argument("squads", help="JSONL file of squads (existing_player_ids, bank_beholdning and weights).")
+    parser.add_argument("output", help="Results file, CSV if it ends with .csv, else JSONL.")
+    parser.add_argument("--game", default=DEFAULT_GAME, choices=list(GAMES), help="Game to optimize for.")
+    parser.add_argument("--recorded", default=None,
+                        help="Use a recorded round file (see backtest.record_round) instead of the live APIs.")
+    parser.add_argument("--api-football-key", default=os.environ.get('API_FOOTBALL_KEY'))
+    parser.add_argument("--max-seconds", type=float, default=30, help="Solver time limit per squad.")
+    parser.add_argument("--weight-value-growth", type=float, default=0,
+                        help="Weight of the forecast player value growth in the objective.")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.recorded:
+        from backtest import load_round
+        holdet, api_football = load_round(args.recorded)
+        round_context = RoundContext(args.api_football_key, GAMES[args.game], holdet=holdet, api_football=api_football)
+    else:
+        round_context = RoundContext(args.api_football_key, GAMES[args.game])
+    summary = run_batch(
+        round_context,
+        read_squads(args.squads),
+        args.output,
+        settings={'max_seconds': args.max_seconds, 'weight_value_growth': args.weight_value_growth},
+        max_workers=args.workers
+    )
+    print(f"Solved {summary['squads']} squads ({summary['errors']} errors) in {summary['seconds']:.1f} s, "
+          f"{summary['squads_per_second']:.2f} squads/s.")
@@ -0,0 +1,415 @@
+import os
+import sys
+import mip
+import time
+import random
+import argparse
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+from typing import List
+
+from data import PlayerTable, Stats
+from search import PlayerSearchIndex
+from backtest import RecordedHoldetDk
+from optimization import OptimizationInput, Optimization
+from portfolio import DEFAULT_PORTFOLIO, get_model_data, solve, solve_portfolio
+
+POSITIONS = [
+    (6, 'Mål', 'Goalkeeper'),
+    (7, 'Forsvar', 'Defense'),
+    (8, 'Midtbane', 'Midfielder'),
+    (9, 'Angreb', 'Striker'),
+]
+
+
+def generate_player_frame(n_players: int, n_teams: int = 24, seed: int = 0) -> pd.DataFrame:
+    """Generate a player DataFrame with the same columns as the merged HoldetDk player data."""
+
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n_players):
+        position_id, position_name, position_name_en = POSITIONS[0] if i % 7 == 0 else POSITIONS[1 + i % 3]
+        team_id = 1 + i % n_teams
+        firstname, lastname = f"First{i}", f"Last{i}"
+        growth = rnd.randrange(-10, 11) * 50_000
+        rows.append({
+            'player_id': 100_000 + i,
+            'person_id': 200_000 + i,
+            'team_id': team_id,
+            'position_id': position_id,
+            'is_eliminated': False,
+            'is_active': True,
+            'person_fullname': f"{firstname} {lastname}",
+            'person_shortname': f"{firstname[0]}. {lastname}",
+            'team_name': f"Team {team_id}",
+            'eliminated': False,
+            'position_name': position_name,
+            'position_name_en': position_name_en,
+            'current_value': rnd.randrange(2, 30) * 250_000,
+            'growth_since_last_round': growth,
+            'total_growth': growth,
+            'popularity': rnd.random(),
+        })
+    return pd.DataFrame(rows)
+
+
+def generate_round_stats(player_ids: list, seed: int = 0) -> list:
+    """Generate Holdet round statistics for the given player IDs."""
+
+    rnd = random.Random(seed)
+    return [
+        {
+            'player': {'id': player_id},
+            'values': {
+                'value': rnd.randrange(2, 30) * 250_000,
+                'growth': rnd.randrange(-10, 11) * 50_000,
+                'totalGrowth': rnd.randrange(-20, 21) * 50_000,
+                'popularity': rnd.random(),
+            }
+        }
+        for player_id in player_ids
+    ]
+
+
+HOLDET_EVENT_POINTS = {
+    300: 100_000, 286: 250_000, 281: 175_000, 291: 150_000, 305: 125_000,  # Events of data.EVENTS
+    278: 60_000, 303: -50_000, 313: -20_000, 280: 75_000, 285: 75_000,  # Assist, cards and clean sheets
+}
+"""Generated Holdet points of the events scored by the optimization."""
+
+
+def generate_holdet_payload(
+        n_players: int,
+        n_teams: int = 24,
+        seed: int = 0,
+        names: List[str] = None,
+        team_ids: List[int] = None,
+        rounds: List[dict] = None
+) -> dict:
+    """Generate HoldetDk game, tournament, ruleset and round statistics payloads in the recorded round format of
+    backtest.RecordedHoldetDk. Player names ("First Last"), team IDs and rounds are generated unless given."""
+
+    team_ids = team_ids or list(range(1, n_teams + 1))
+    names = names or [f"First{i} Last{i}" for i in range(n_players)]
+    teams = [{'id': team_id, 'name': f"Team {team_id}", 'eliminated': False} for team_id in team_ids]
+    persons = []
+    for i in range(n_players):
+        firstname, _, lastname = names[i].partition(' ')
+        persons.append({'id': 200_000 + i, 'firstname': firstname, 'lastname': lastname})
+    players = [
+        {
+            'id': 100_000 + i,
+            'person': {'id': 200_000 + i},
+            'team': {'id': team_ids[i % len(team_ids)]},
+            'position': {'id': POSITIONS[0][0] if i % 7 == 0 else POSITIONS[1 + i % 3][0]},
+            'eliminated': False,
+            'active': True,
+        }
+        for i in range(n_players)
+    ]
+    return {
+        'game_id': 0,
+        'game': {
+            'tournament': {'id': 0},
+            'ruleset': {'id': 0},
+            'rounds': rounds or [
+                {'start': '2024-06-14T00:00:00Z', 'close': '2024-06-14T00:00:00Z', 'end': '2024-06-19T00:00:00Z'}
+            ],
+        },
+        'tournament': {'teams': teams, 'persons': persons, 'players': players},
+        'ruleset': {
+            'positions': [{'id': position_id, 'name': name} for position_id, name, _ in POSITIONS],
+            'fantasyEventTypes': [
+                {'id': event_id, 'value': points} for event_id, points in HOLDET_EVENT_POINTS.items()
+            ],
+        },
+        'round_stats': generate_round_stats([player['id'] for player in players], seed=seed),
+    }
+
+
+class GeneratedStats:
+    """Stats where every player appears."""
+
+    def __init__(self, names: list):
+        self.names = names
+
+    def get_prob_appearance(self) -> dict:
+        return {name: 1.0 for name in self.names}
+
+
+class GeneratedOptimizationInput(OptimizationInput):
+    """Optimization input of generated players, without HoldetDk, ApiFootball or Stats data. Player values are random
+    and expected scores are close to the values, which makes the budget constraint hard to solve (like a subset sum
+    problem), so solve times vary between instances. With a value_step, values are multiples of it, like the Holdet
+    values, and with a larger score_noise the expected scores are less related to the values."""
+
+    def __init__(
+            self,
+            n_players: int,
+            seed: int = 0,
+            bank_beholdning: float = 50_000_000,
+            value_step: int = 1,
+            score_noise: float = 10_000
+    ):
+        frame = generate_player_frame(n_players, seed=seed)
+        rng = np.random.default_rng(seed)
+        frame['current_value'] = rng.integers(500_000, 7_500_000, n_players) // value_step * value_step
+        frame['expected_score'] = frame['current_value'] + rng.normal(0, score_noise, n_players)
+        self.players = PlayerTable.from_frame(frame)
+        self.stats = GeneratedStats(frame['person_fullname'].tolist())
+        self.existing_player_ids = []
+        self.bank_beholdning = bank_beholdning
+
+    def get_current_round_injured_players(self):
+        return []
+
+    def name_lookup_holdet_to_stats(self, name: str, fuzz_match_ratio: float = 80) -> str:
+        return name
+
+
+def _traced_size(build) -> (object, int):
+    """Return the object built by `build` and the number of bytes allocated while building it."""
+
+    tracemalloc.start()
+    obj = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size
+
+
+def benchmark_player_table_memory(player_counts=(1_000, 10_000)) -> pd.DataFrame:
+    """Compare the memory footprint of the player data as list-of-dicts and as PlayerTable. Both are built from a
+    freshly generated frame inside the trace, so memory shared with an existing frame (the table's numeric columns are
+    views of the frame's arrays, the records share its strings) is counted. PlayerTable.nbytes is reported as a check
+    of the traced table size."""
+
+    rows = []
+    for n_players in player_counts:
+        _, records_bytes = _traced_size(lambda: generate_player_frame(n_players).to_dict('records'))
+        table, table_bytes = _traced_size(lambda: PlayerTable.from_frame(generate_player_frame(n_players)))
+        rows.append({
+            'players': n_players,
+            'list_of_dicts_bytes': records_bytes,
+            'player_table_bytes': table_bytes,
+            'player_table_nbytes': table.nbytes,
+            'ratio': records_bytes / table_bytes,
+        })
+    return pd.DataFrame(rows)
+
+
+def benchmark_round_stats_refresh(player_counts=(1_000, 10_000), changed_portion: float = 0.1) -> pd.DataFrame:
+    """Compare the latency of a full HoldetDk rebuild with HoldetDk.refresh_round_stats (as done by
+    RoundContext.refresh_if_stale), where a portion of the players have changed statistics. Only the Holdet data is
+    refreshed, the players are not re-scored. Network time is excluded, the full rebuild does 3 more requests."""
+
+    rows = []
+    for n_players in player_counts:
+        payload = generate_holdet_payload(n_players)
+        start = time.perf_counter()
+        holdet = RecordedHoldetDk(payload, round_number=1)
+        full_rebuild_seconds = time.perf_counter() - start
+
+        n_changed = int(n_players * changed_portion)
+        changed_stats = generate_round_stats([stats['player']['id'] for stats in payload['round_stats']], seed=1)
+        payload['round_stats'] = changed_stats[:n_changed] + payload['round_stats'][n_changed:]
+        start = time.perf_counter()
+        changes = holdet.refresh_round_stats()
+        refresh_seconds = time.perf_counter() - start
+        rows.append({
+            'players': n_players,
+            'changed_players': len(set(change['player_id'] for change in changes)),
+            'full_rebuild_ms': full_rebuild_seconds * 1000,
+            'refresh_ms': refresh_seconds * 1000,
+            'speedup': full_rebuild_seconds / refresh_seconds,
+        })
+    return pd.DataFrame(rows)
+
+
+def _subprocess_ms(code: str) -> float:
+    """Run code in a fresh Python process and return its run time in ms, so module imports are measured cold."""
+
+    timed = f"import time\n_start = time.perf_counter()\n{code}\nprint((time.perf_counter() - _start) * 1000)"
+    output = subprocess.run([sys.executable, "-c", timed], capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def benchmark_cold_start(repeats: int = 3) -> pd.DataFrame:
+    """Measure the import time of main and the one-off cost of the first request that is moved to the warmup request:
+    importing the heavy modules, loading the CBC library and loading the Stats dataset. Network requests of the round
+    context are excluded."""
+
+    phases = {
+        'import main': "import main",
+        'import main and heavy modules (eager imports)':
+            "import main, pandas, mip, thefuzz.fuzz, data, optimization",
+        'first request without warmup (imports, CBC, Stats)':
+            "import main, mip, context, data\nmip.Model(solver_name=mip.CBC)\ndata.Stats()",
+    }
+    return pd.DataFrame([
+        {'phase': phase, 'ms': min(_subprocess_ms(code) for _ in range(repeats))} for phase, code in phases.items()
+    ])
+
+
+def benchmark_stats_load(repeats: int = 5) -> pd.DataFrame:
+    """Compare loading the players stats used by the optimization from the full CSV, from the column-pruned CSV and
+    from the compiled dataset (run compile_datasets.py first)."""
+
+    stats = Stats()
+
+    def load_full_csv():
+        pd.read_csv(stats.data_players.source)
+
+    def load_pruned_csv():
+        pd.read_csv(stats.data_players.source, usecols=Stats.PLAYER_COLUMNS)
+
+    def load_compiled():
+        compiled_stats = Stats()
+        if compiled_stats.data_players.manifest is None:
+            raise Exception("No compiled dataset found. Run compile_datasets.py first.")
+        compiled_stats.get_prob_appearance()
+
+    rows = []
+    for method, load in [('full csv', load_full_csv), ('pruned csv', load_pruned_csv), ('compiled', load_compiled)]:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            load()
+            timings.append(time.perf_counter() - start)
+        rows.append({'method': method, 'ms': min(timings) * 1000})
+    return pd.DataFrame(rows)
+
+
+def benchmark_solver_portfolio(n_instances: int = 8, n_players: int = 600, max_seconds: float = 30) -> pd.DataFrame:
+    """Compare solve latency percentiles of the default CBC configuration with racing DEFAULT_PORTFOLIO in parallel
+    processes, on generated instances. 'best configuration' is the fastest configuration per instance when solved on
+    its own, i.e. the portfolio latency when every configuration has a CPU core of its own. With fewer cores than
+    configurations (see the cpus column) the measured portfolio shares the cores and is slower."""
+
+    timings = {'default configuration': [], 'portfolio': [], 'best configuration': []}
+    for seed in range(n_instances):
+        optimization = Optimization(GeneratedOptimizationInput(n_players, seed=seed), transfer_cost_rate=0)
+        optimization.build_model()
+        model_data = get_model_data(optimization.model)
+        config_seconds = [solve(model_data, config, max_seconds)['seconds'] for config in DEFAULT_PORTFOLIO]
+        timings['default configuration'].append(config_seconds[0])
+        timings['best configuration'].append(min(config_seconds))
+        start = time.perf_counter()
+        solve_portfolio(optimization.model, DEFAULT_PORTFOLIO, max_seconds=max_seconds)
+        timings['portfolio'].append(time.perf_counter() - start)
+    return pd.DataFrame([
+        {
+            'method': method,
+            'configurations': 1 if method == 'default configuration' else len(DEFAULT_PORTFOLIO),
+            'cpus': os.cpu_count(),
+            'p50_s': np.percentile(seconds, 50),
+            'p90_s': np.percentile(seconds, 90),
+            'max_s': max(seconds),
+        }
+        for method, seconds in timings.items()
+    ])
+
+
+def benchmark_presolve(
+        n_instances: int = 8,
+        n_players: int = 600,
+        value_step: int = 50_000,
+        score_noise: float = 1_000_000,
+        max_seconds: float = 30
+) -> pd.DataFrame:
+    """Compare model size, build and solve time and the optimum with and without pruning dominated players in the
+    presolve, on generated instances with Holdet-like value steps and expected scores loosely related to the values,
+    with the default minimum spend and without. The optimum must be the same (max_optimum_diff 0), as pruning only
+    drops players that an optimal team never needs."""
+
+    rows = []
+    for min_spend_portion in (0.95, 0):
+        for seed in range(n_instances):
+            for prune_dominated in (False, True):
+                optimization = Optimization(
+                    GeneratedOptimizationInput(n_players, seed=seed, value_step=value_step, score_noise=score_noise),
+                    min_spend_portion=min_spend_portion,
+                    max_seconds=max_seconds,
+                    prune_dominated=prune_dominated
+                )
+                start = time.perf_counter()
+                optimization.build_model()
+                build_seconds = time.perf_counter() - start
+                optimization.run()
+                rows.append({
+                    'min_spend_portion': min_spend_portion,
+                    'seed': seed,
+                    'prune_dominated': prune_dominated,
+                    'variables': optimization.model.num_cols,
+                    'dominated': optimization.presolve_stats['dominated'],
+                    'build_s': build_seconds,
+                    'solve_s': time.perf_counter() - start - build_seconds,
+                    'optimal': optimization.model.status == mip.OptimizationStatus.OPTIMAL,
+                    'optimum': optimization.model.objective_value,
+                })
+    results = pd.DataFrame(rows)
+    unpruned = results[~results['prune_dominated']].set_index(['min_spend_portion', 'seed'])['optimum']
+    results['optimum_diff'] = results['optimum'] - unpruned.loc[
+        list(zip(results['min_spend_portion'], results['seed']))
+    ].to_numpy()
+    return results.groupby(['min_spend_portion', 'prune_dominated'], as_index=False).agg(
+        variables=('variables', 'mean'),
+        dominated=('dominated', 'mean'),
+        build_s=('build_s', 'mean'),
+        solve_p50_s=('solve_s', 'median'),
+        solve_max_s=('solve_s', 'max'),
+        all_optimal=('optimal', 'all'),
+        max_optimum_diff=('optimum_diff', lambda diff: diff.abs().max()),
+    )
+
+
+def benchmark_player_search(
+        n_players: int = 10_000,
+        queries=('mid', 'mad mid', 'mads madsen', 'first1', 'team 1 def', 'goal'),
+        repeats: int = 100
+) -> pd.DataFrame:
+    """Time player searches on generated players, one of them a midfielder named Mads Madsen, whose tokens share
+    prefixes (as do Midtbane and Midfielder). Every player must be returned at most once (duplicates 0)."""
+
+    frame = generate_player_frame(n_players)
+    frame.loc[1, 'person_fullname'] = 'Mads Madsen'
+    start = time.perf_counter()
+    index = PlayerSearchIndex(PlayerTable.from_frame(frame))
+    build_seconds = time.perf_counter() - start
+    rows = []
+    for query in queries:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = index.search(query)
+        rows.append({
+            'query': query,
+            'build_ms': build_seconds * 1000,
+            'search_ms': (time.perf_counter() - start) / repeats * 1000,
+            'results': len(result),
+            'duplicates': len(result) - len(np.unique(result)),
+        })
+    return pd.DataFrame(rows)
+
+
+BENCHMARKS = {
+    'player_table_memory': benchmark_player_table_memory,
+    'round_stats_refresh': benchmark_round_stats_refresh,
+    'cold_start': benchmark_cold_start,
+    'stats_load': benchmark_stats_load,
+    'solver_portfolio': benchmark_solver_portfolio,
+    'presolve': benchmark_presolve,
+    'player_search': benchmark_player_search,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run benchmarks.")
+    parser.add_argument("names", nargs="*", help=f"Benchmarks to run, default all of: {', '.join(BENCHMARKS)}.")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}.")
+    for name in args.names or BENCHMARKS:
+        print(f"# {name}")
+        print(BENCHMARKS[name]().to_string(index=False))
+        sys.stdout.flush()
@@ -0,0 +1,63 @@
+import os
+import glob
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from typing import List
+
+from data import DATASETS_DIR, COMPILED_DATASETS_DIR, Stats, load_datasets_registry
+
+TABLE_COLUMNS = {
+    'players': Stats.PLAYER_COLUMNS,
+}
+"""Columns to compile for each table. Tables not listed here are compiled with all columns."""
+
+
+def compile_table(name: str, table: str, source_path: str, columns: List[str] = None) -> str:
+    """Compile a CSV table to one .npy file per column and a manifest.json. Text columns are stored as fixed width
+    unicode, so every column can be memory-mapped. Returns the directory of the compiled table."""
+
+    frame = pd.read_csv(source_path, usecols=columns)
+    table_dir = os.path.join(COMPILED_DATASETS_DIR, name, table)
+    os.makedirs(table_dir, exist_ok=True)
+    for old_file in glob.glob(os.path.join(table_dir, '*')):
+        os.remove(old_file)
+
+    manifest_columns = {}
+    for i, column in enumerate(frame.columns):
+        values = frame[column]
+        array = values.fillna('').astype(str).to_numpy(dtype=str) if values.dtype == object else values.to_numpy()
+        file_name = f'{i:04d}.npy'
+        np.save(os.path.join(table_dir, file_name), array, allow_pickle=False)
+        manifest_columns[column] = {'file': file_name, 'dtype': array.dtype.str}
+
+    # The manifest is written last, so an interrupted compile is not picked up by Stats.
+    with open(os.path.join(table_dir, 'manifest.json'), 'w') as f:
+        json.dump({
+            'name': name,
+            'table': table,
+            'source': os.path.basename(source_path),
+            'rows': len(frame),
+            'columns': manifest_columns,
+        }, f, indent=2)
+    return table_dir
+
+
+def compile_datasets(names: List[str] = None):
+    """Compile the datasets of datasets/datasets.json, all of them by default. Run this as a build step before
+    deploying. A new tournament dataset is added by placing its CSVs in datasets/, adding it to datasets.json and
+    compiling it, and is selected with the STATS_DATASET environment variable."""
+
+    registry = load_datasets_registry()
+    for name in names or registry['datasets'].keys():
+        for table, source in registry['datasets'][name].items():
+            table_dir = compile_table(name, table, os.path.join(DATASETS_DIR, source), TABLE_COLUMNS.get(table))
+            print(f'Compiled {source} to {table_dir}.')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the CSV datasets to column-pruned, memory-mappable files.")
+    parser.add_argument("names", nargs="*", help="Datasets of datasets/datasets.json to compile, default all.")
+    args = parser.parse_args()
+    compile_datasets(args.names)
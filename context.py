@@ -0,0 +1,304 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict
+
+from data import (
+    ApiFootball, HoldetDk, Stats, OddsTable, PlayerTable, GAMES, DEFAULT_GAME, EVENTS, ROUND_STATS_COLUMNS,
+    payload_nbytes
+)
+from optimization import OptimizationInput
+from search import PlayerSearchIndex
+from solve_cache import SolveCache
+from value_history import ValueHistory
+
+
+class RoundContext:
+    """Data for the current round of a game that is shared between requests, so the Holdet data, the api-football
+    odds, odds table and predictions, the stats dataset and the scored player tables are not fetched, loaded and
+    computed for every request. The Holdet round statistics are refreshed incrementally when they are older than the
+    game's refresh_seconds, and all data is reloaded when the round switches. Every distinct snapshot of the round
+    statistics is appended to the game's value history."""
+
+    MAX_SCORED_PLAYER_TABLES = 8
+    """Number of scored player tables (one per data version and set of weights) kept per context."""
+
+    def __init__(self, api_football_key: str, game: dict, holdet: HoldetDk = None, api_football: ApiFootball = None):
+        """The Holdet and api-football data of the game is fetched unless given, e.g. from a recorded round. Only a
+        live context, whose Holdet data is fetched, clears the shared solve cache on new data and appends to the value
+        history, so batches and replays of recorded rounds on an instance leave the app's cache and history alone."""
+
+        self.game = game
+        self.refresh_seconds = game['refresh_seconds']
+        self.team_id_map = game['team_id_map']
+        self.holdet = holdet or HoldetDk(game_id=game['holdet_game_id'])
+        self.api_football = api_football or ApiFootball(
+            api_football_key, league_id=game['api_football_league_id'], season=game['api_football_season']
+        )
+        self.stats = Stats(dataset=game['stats_dataset'])
+        self._scored_players = OrderedDict()
+        self._search_index = None
+        self.solve_cache = SolveCache(f"game_{game['holdet_game_id']}")
+        self.value_history = ValueHistory(f"game_{game['holdet_game_id']}")
+        self.is_live = holdet is None
+        self._lock = threading.Lock()
+        self._fetch_round_data()
+        self._update_data_version()
+        self._update_value_history()
+
+    def _fetch_round_data(self):
+        """Fetch odds and predictions for the fixtures of the current round."""
+
+        round_start, round_end = self.holdet.current_round_start_end_time
+        self.odds = self.api_football.get_odds(
+            bet_ids=list(set([event['bet_id'] for i, event in EVENTS.items()])),
+            latest_fixture_time_utc=round_end
+        )
+        self.predictions = self.api_football.get_fixture_predictions(
+            earliest_fixture_time_utc=round_start,
+            latest_fixture_time_utc=round_end
+        )
+        self.odds_table = OddsTable(self.odds)
+        # The raw payloads are kept (e.g. the predictions and fixtures are read when scoring), so they are counted in
+        # nbytes. Measured once per fetch, as they do not change until the next.
+        self._payload_nbytes = payload_nbytes([
+            self.odds, self.predictions, self.api_football.fixtures, self.holdet.game_data,
+            self.holdet.tournament_data, self.holdet.ruleset_data
+        ])
+        self.refreshed_at = time.monotonic()
+
+    def refresh_if_stale(self) -> List[dict]:
+        """Refresh the Holdet round statistics if they are older than refresh_seconds. If the round has switched, the
+        Holdet data is reloaded instead, as players are eliminated, deactivated and added between rounds, and the odds
+        and predictions are fetched for the new round. Returns the change log of the round statistics, which is empty
+        on a round switch."""
+
+        with self._lock:
+            if time.monotonic() - self.refreshed_at < self.refresh_seconds:
+                return []
+            round_switched = self.holdet.get_current_round_start_end_datetime() != \
+                self.holdet.current_round_start_end_time
+            if round_switched:
+                self.holdet = HoldetDk(
+                    game_id=self.holdet.game_id, api_url=self.holdet.api_url, stats_api_url=self.holdet.stats_api_url
+                )
+                self._search_index = None
+                self._fetch_round_data()
+                changes = []
+            else:
+                changes = self.holdet.refresh_round_stats()
+                self.refreshed_at = time.monotonic()
+            if len(changes) > 0 or round_switched:
+                previous_data_version = self.data_version
+                self._update_data_version()
+                self._update_value_history()
+                if round_switched:
+                    self._scored_players.clear()
+                else:
+                    self._rekey_scored_players(previous_data_version)
+            return changes
+
+    def _rekey_scored_players(self, previous_data_version: str):
+        """Move the scored players of the previous data version to the current one, with the refreshed round statistics
+        and value growth forecast. The expected score does not depend on the round statistics, so the players are not
+        re-scored. Call with the lock held, after a refresh within a round, which keeps the players and their order."""
+
+        columns = {column: self.holdet.player_data.column(column) for column in ROUND_STATS_COLUMNS}
+        columns['expected_value_growth'] = self.expected_value_growth
+        scored_players = self._scored_players
+        self._scored_players = OrderedDict(
+            ((self.data_version, weights), players.with_columns(columns))
+            for (data_version, weights), players in scored_players.items() if data_version == previous_data_version
+        )
+
+    def _update_data_version(self):
+        """Set data_version to a hash of the game, the round and the player data, which is the same in every process
+        for the same data, and, in a live context, invalidate the solve results of other data versions."""
+
+        digest = hashlib.sha1(f"{self.game['holdet_game_id']}:{self.holdet.current_round_start_end_time}".encode())
+        for column in self.holdet.player_data.columns:
+            values = self.holdet.player_data.column(column)
+            digest.update(values.tobytes() if values.dtype != object else repr(values.tolist()).encode())
+        self.data_version = digest.hexdigest()[:16]
+        if self.is_live:
+            self.solve_cache.set_data_version(self.data_version)
+
+    def _update_value_history(self):
+        """Append the round statistics to the value history and set expected_value_growth to the forecast value change
+        of each player in the next round, in the order of the Holdet player data."""
+
+        round_number = self.holdet.get_current_round()
+        if self.is_live:
+            self.value_history.append(round_number, self.holdet.player_data)
+        self.expected_value_growth = self.value_history.forecast_value_change(
+            self.holdet.player_data.column('player_id'), end_round=round_number
+        )
+
+    def get_search_index(self) -> PlayerSearchIndex:
+        """Return the player search index, rebuilt when the player data has changed."""
+
+        with self._lock:
+            if self._search_index is None or self._search_index.players is not self.holdet.player_data:
+                self._search_index = PlayerSearchIndex(self.holdet.player_data)
+            return self._search_index
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint of the player and odds tables, the raw Holdet and api-football payloads and the
+        value history chunks in bytes."""
+
+        with self._lock:
+            scored_players = list(self._scored_players.values())
+        # The scored tables share all columns but expected_score with the Holdet player data.
+        scored_players_nbytes = sum(players.column('expected_score').nbytes for players in scored_players)
+        return self.holdet.player_data.nbytes + self.odds_table.nbytes + self._payload_nbytes + \
+            self.value_history.nbytes + scored_players_nbytes
+
+    def _get_scored_players(self, key: tuple) -> PlayerTable | None:
+        with self._lock:
+            players = self._scored_players.get(key)
+            if players is not None:
+                self._scored_players.move_to_end(key)
+            return players
+
+    def _set_scored_players(self, key: tuple, players: PlayerTable):
+        """Cache players scored for key, (data version, weights), unless the data has been refreshed since."""
+
+        with self._lock:
+            if key[0] != self.data_version:
+                return
+            self._scored_players[key] = players
+            while len(self._scored_players) > self.MAX_SCORED_PLAYER_TABLES:
+                self._scored_players.popitem(last=False)
+
+    def get_optimization_input(
+            self,
+            existing_player_ids: list,
+            bank_beholdning: float,
+            weight_team_win: float,
+            weight_player_goals: float,
+            weight_player_assists: float,
+            weight_player_cards: float,
+            weight_player_clean_sheets: float,
+            injuries: list = None,
+            players: PlayerTable = None
+    ) -> OptimizationInput:
+        """Players scored with the weights are taken from the cache of the context unless given, e.g. by a batch that
+        keeps the scored players of more weights than the cache holds."""
+
+        # Scored outside the lock, so the data may be refreshed meanwhile; the scored players are cached by version.
+        key = (self.data_version, (weight_team_win, weight_player_goals, weight_player_assists, weight_player_cards,
+                                   weight_player_clean_sheets))
+        optimization_input = OptimizationInput(
+            holdet=self.holdet,
+            api_football=self.api_football,
+            stats=self.stats,
+            existing_player_ids=existing_player_ids,
+            bank_beholdning=bank_beholdning,
+            weight_team_win=weight_team_win,
+            weight_player_goals=weight_player_goals,
+            weight_player_assists=weight_player_assists,
+            weight_player_cards=weight_player_cards,
+            weight_player_clean_sheets=weight_player_clean_sheets,
+            team_id_map=self.team_id_map,
+            events=EVENTS,
+            odds=self.odds,
+            predictions=self.predictions,
+            odds_table=self.odds_table,
+            players=players if players is not None else self._get_scored_players(key),
+            injuries=injuries,
+            data_version=key[0]
+        )
+        if 'expected_value_growth' not in optimization_input.players.columns:
+            # The scored players are in the order of the Holdet player data, like the forecast.
+            optimization_input.players = optimization_input.players.with_column(
+                'expected_value_growth', self.expected_value_growth
+            )
+        if self.data_version != key[0]:
+            # Refreshed while scoring, so the input may mix data versions.
+            optimization_input.data_version = None
+        self._set_scored_players(key, optimization_input.players)
+        return optimization_input
+
+
+class RoundContextRegistry:
+    """Round contexts by game key, so one instance can serve several games without reloading a game on every switch.
+    Contexts are loaded on first use, and the least recently used are evicted when there are more than max_contexts
+    or their approximate memory footprint exceeds max_bytes."""
+
+    def __init__(
+            self,
+            api_football_key: str,
+            games: Dict[str, dict] = GAMES,
+            max_contexts: int = 4,
+            max_bytes: int = 256 * 1024 ** 2
+    ):
+        self.api_football_key = api_football_key
+        self.games = games
+        self.max_contexts = max_contexts
+        self.max_bytes = max_bytes
+        self._contexts = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {game_key: threading.Lock() for game_key in games}
+
+    def __contains__(self, game_key: str) -> bool:
+        return game_key in self._contexts
+
+    def get(self, game_key: str) -> RoundContext:
+        """Return the round context of a game, loading it if needed and refreshing it if stale. Raises KeyError for
+        unknown games."""
+
+        if game_key not in self.games:
+            raise KeyError(f"Unknown game {game_key}.")
+        context = self._get_loaded(game_key)
+        if context is None:
+            # Only one thread loads a given game, other threads requesting it wait for the load.
+            with self._load_locks[game_key]:
+                context = self._get_loaded(game_key)
+                if context is None:
+                    start = time.perf_counter()
+                    context = RoundContext(self.api_football_key, self.games[game_key])
+                    logging.info(f'Round context for game {game_key} loaded in '
+                                 f'{(time.perf_counter() - start) * 1000:.0f} ms.')
+                    with self._lock:
+                        self._contexts[game_key] = context
+                        self._evict()
+        context.refresh_if_stale()
+        return context
+
+    def _get_loaded(self, game_key: str) -> RoundContext | None:
+        with self._lock:
+            context = self._contexts.get(game_key)
+            if context is not None:
+                self._contexts.move_to_end(game_key)
+            return context
+
+    def _evict(self):
+        """Evict the least recently used contexts, always keeping the most recently used. Call with the lock held."""
+
+        sizes = {game_key: context.nbytes for game_key, context in self._contexts.items()}
+        total_bytes = sum(sizes.values())
+        while len(self._contexts) > 1 and (len(self._contexts) > self.max_contexts or total_bytes > self.max_bytes):
+            game_key, context = self._contexts.popitem(last=False)
+            total_bytes -= sizes[game_key]
+            logging.info(f'Round context for game {game_key} evicted.')
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(api_football_key: str) -> RoundContextRegistry:
+    """Return the round context registry of the process, creating it on first use."""
+
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = RoundContextRegistry(api_football_key)
+    return _registry
+
+
+def get_round_context(api_football_key: str, game_key: str = DEFAULT_GAME) -> RoundContext:
+    return get_registry(api_football_key).get(game_key)
@@ -1,6 +1,11 @@
+import os
+import re
+import sys
+import unicodedata
 import requests
 import json
 import logging
+import numpy as np
 import pandas as pd
 import datetime as dt
 from typing import List, Dict
@@ -99,13 +104,207 @@ EVENTS = {
 mapping IDs for corresponding bet.
 """
 
+HOLDET_API_URL = os.environ.get('HOLDET_API_URL', 'https://api.holdet.dk')
+SWUSH_API_URL = os.environ.get('SWUSH_API_URL', 'https://fs-api.swush.com')
+API_FOOTBALL_URL = os.environ.get('API_FOOTBALL_URL', 'https://v3.football.api-sports.io')
+"""Base URLs of the Holdet, Holdet round statistics (swush) and api-football APIs. Set the environment variables to
+point the app at other servers, e.g. the stub servers of loadtest.py."""
+
+GAMES = {
+    "euro2024": {
+        "name": "EURO 2024",
+        "holdet_game_id": 686,
+        "api_football_league_id": 4,
+        "api_football_season": 2024,
+        "stats_dataset": "footystats_euro2024_qualifiers",
+        "team_id_map": TEAM_ID_MAP,
+        "refresh_seconds": 300,
+    },
+}
+"""Games that can be served, by game key. Each game maps to a Holdet game, an api-football league and season, a stats
+dataset of datasets/datasets.json and a team ID map from Holdet to api-football. The round statistics of a game are
+refreshed when they are older than refresh_seconds."""
+
+DEFAULT_GAME = "euro2024"
+
+DATASETS_DIR = 'datasets'
+COMPILED_DATASETS_DIR = os.path.join(DATASETS_DIR, 'compiled')
+DATASETS_REGISTRY_PATH = os.path.join(DATASETS_DIR, 'datasets.json')
+"""Registry of stats datasets. Each dataset maps table names (players, teams) to source CSV files in DATASETS_DIR."""
+
+ROUND_STATS_COLUMNS = {
+    'current_value': 'value',
+    'growth_since_last_round': 'growth',
+    'total_growth': 'totalGrowth',
+    'popularity': 'popularity',
+}
+"""Player data columns from the Holdet round statistics (key) and the corresponding round statistics value (value)."""
+
+
+def column_nbytes(column: np.ndarray) -> int:
+    """Approximate memory footprint of a column in bytes, including the objects of an object column."""
+
+    size = column.nbytes
+    if column.dtype == object:
+        size += sum(sys.getsizeof(value) for value in {id(v): v for v in column}.values())
+    return size
+
+
+def payload_nbytes(payload) -> int:
+    """Approximate memory footprint of a parsed JSON payload (dicts, lists and values) in bytes, counting every object
+    once."""
+
+    size = 0
+    seen = set()
+    stack = [payload]
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        size += sys.getsizeof(value)
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return size
+
+
+def load_datasets_registry() -> dict:
+    with open(DATASETS_REGISTRY_PATH) as f:
+        return json.load(f)
+
+
+class PlayerRow:
+    """Read-only view of a single player in a PlayerTable. Values are accessed like a dict, e.g. player['player_id']."""
+
+    __slots__ = ('_columns', '_idx')
+
+    def __init__(self, columns: Dict[str, np.ndarray], idx: int):
+        self._columns = columns
+        self._idx = idx
+
+    def __getitem__(self, key: str):
+        return self._columns[key][self._idx]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._columns
+
+    def get(self, key: str, default=None):
+        column = self._columns.get(key)
+        return default if column is None else column[self._idx]
+
+    def keys(self):
+        return self._columns.keys()
+
+    def to_dict(self) -> dict:
+        return {key: column[self._idx].item() if isinstance(column[self._idx], np.generic) else column[self._idx]
+                for key, column in self._columns.items()}
+
+    def __repr__(self):
+        return f"PlayerRow({self.to_dict()})"
+
+
+class PlayerTable:
+    """Immutable columnar table of players. Each column is a read-only numpy array, rows are read through PlayerRow
+    views and looked up by player_id through an index. Derived columns, e.g. expected_score, are added with
+    `with_column`, which returns a new table sharing the existing columns."""
+
+    __slots__ = ('_columns', '_index', '_len')
+
+    def __init__(self, columns: Dict[str, np.ndarray], index: Dict[int, int] = None):
+        self._columns = {}
+        lengths = set()
+        for name, values in columns.items():
+            column = np.asarray(values).view()
+            column.flags.writeable = False
+            self._columns[name] = column
+            lengths.add(len(column))
+        if len(lengths) > 1:
+            raise ValueError(f"All columns of a PlayerTable must have the same length, got lengths {lengths}.")
+        self._len = lengths.pop() if lengths else 0
+        self._index = index if index is not None else {
+            player_id: i for i, player_id in enumerate(self._columns['player_id'].tolist())
+        }
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> 'PlayerTable':
+        return cls({name: frame[name].to_numpy() for name in frame.columns})
+
+    @classmethod
+    def from_records(cls, records: List[dict]) -> 'PlayerTable':
+        return cls.from_frame(pd.DataFrame.from_records(records))
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self):
+        return (PlayerRow(self._columns, i) for i in range(self._len))
+
+    def __getitem__(self, idx: int) -> PlayerRow:
+        if not -self._len <= idx < self._len:
+            raise IndexError(f"Row {idx} is out of range for a PlayerTable of {self._len} players.")
+        return PlayerRow(self._columns, idx % self._len)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns.keys())
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name]
+
+    def index_of(self, player_id: int) -> int:
+        """Return the row number of a player_id. Raises KeyError for unknown players."""
+
+        return self._index[player_id]
+
+    def indices_of(self, player_ids) -> np.ndarray:
+        """Return the row numbers of the given player IDs. Unknown player IDs are skipped."""
+
+        return np.fromiter(
+            (self._index[player_id] for player_id in player_ids if player_id in self._index), dtype=np.int64
+        )
+
+    def row_by_id(self, player_id: int) -> PlayerRow:
+        return PlayerRow(self._columns, self._index[player_id])
+
+    def with_column(self, name: str, values) -> 'PlayerTable':
+        """Return a new table with the column added or replaced. The other columns and the index are shared."""
+
+        return self.with_columns({name: values})
+
+    def with_columns(self, columns: Dict[str, np.ndarray]) -> 'PlayerTable':
+        """Return a new table with the columns added or replaced. The other columns and the index are shared."""
+
+        return PlayerTable({**self._columns, **columns}, index=self._index)
+
+    def take(self, rows) -> 'PlayerTable':
+        """Return a new table of the given rows, in the given order."""
+
+        return PlayerTable({name: column[rows] for name, column in self._columns.items()})
+
+    def to_records(self) -> List[dict]:
+        return self.to_frame().to_dict('records')
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self._columns)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint of the table in bytes, including the index and the string objects."""
+
+        return sys.getsizeof(self._index) + sum(column_nbytes(column) for column in self._columns.values())
+
 
 class HoldetDk:
     """Data import class from https://www.holdet.dk/da."""
 
     # Default game is EURO 2024.
-    def __init__(self, game_id: int = 686):
+    def __init__(self, game_id: int = 686, api_url: str = None, stats_api_url: str = None):
         self.game_id = game_id
+        self.api_url = api_url or HOLDET_API_URL
+        self.stats_api_url = stats_api_url or SWUSH_API_URL
         self.game_data = self.get_game_data()
         self.tournament_data = self.get_tournament_data()
         self.ruleset_data = self.get_ruleset_data()
@@ -114,23 +313,23 @@ class HoldetDk:
 
     def get_game_data(self) -> dict:
         game_data = requests.get(
-            f"https://api.holdet.dk/catalog/games/{self.game_id}?v=3&appid=holdet&culture=da-DK")
+            f"{self.api_url}/catalog/games/{self.game_id}?v=3&appid=holdet&culture=da-DK")
         game_data_dict = json.loads(game_data.text)
         return game_data_dict
 
     def get_tournament_data(self) -> dict:
         tournament_data = requests.get(
-            f"https://api.holdet.dk/tournaments/{self.game_data['tournament']['id']}?appid=holdet&culture=da-DK")
+            f"{self.api_url}/tournaments/{self.game_data['tournament']['id']}?appid=holdet&culture=da-DK")
         tournament_data_dict = json.loads(tournament_data.text)
         return tournament_data_dict
 
     def get_ruleset_data(self) -> dict:
         ruleset_response = requests.get(
-            f"https://api.holdet.dk/rulesets/{self.game_data['ruleset']['id']}?appid=holdet&culture=da-DK")
+            f"{self.api_url}/rulesets/{self.game_data['ruleset']['id']}?appid=holdet&culture=da-DK")
         ruleset_dict = json.loads(ruleset_response.text)
         return ruleset_dict
 
-    def get_player_data(self) -> List[dict]:
+    def get_player_data(self) -> PlayerTable:
         tournament_data = self.tournament_data
         teams = {}
         for team in tournament_data['teams']:
@@ -171,10 +370,7 @@ class HoldetDk:
         for player in round_stats:
             player_stats[player['player']['id']] = {
                 'player_id': player['player']['id'],
-                'current_value': player['values']['value'],
-                'growth_since_last_round': player['values']['growth'],
-                'total_growth': player['values']['totalGrowth'],
-                'popularity': player['values']['popularity']
+                **{column: player['values'][key] for column, key in ROUND_STATS_COLUMNS.items()}
             }
         player_data = pd.DataFrame.from_dict(players, orient='index').merge(
             pd.DataFrame.from_dict(persons, orient='index'), on='person_id', how='left').merge(
@@ -182,7 +378,42 @@ class HoldetDk:
             pd.DataFrame.from_dict(positions, orient='index'), on='position_id', how='left').merge(
             pd.DataFrame.from_dict(player_stats, orient='index'), on='player_id', how='left'
         )
-        return player_data.to_dict('records')
+        return PlayerTable.from_frame(player_data)
+
+    def refresh_round_stats(self) -> List[dict]:
+        """Refresh only the round statistics (values, growth and popularity) instead of rebuilding all player data.
+        Players whose statistics changed get new values in a copy of the round statistics columns, the other columns
+        are shared with the previous player data. Returns a change log with an entry for each changed value."""
+
+        self.current_round_start_end_time = self.get_current_round_start_end_datetime()
+        round_stats = self.get_current_round_stats()
+        players = self.player_data
+        columns = {column: players.column(column).copy() for column in ROUND_STATS_COLUMNS}
+        changes = []
+        for player in round_stats:
+            player_id = player['player']['id']
+            try:
+                idx = players.index_of(player_id)
+            except KeyError:
+                logging.warning(f'Round statistics for unknown player ID {player_id} ignored. A full reload of the '
+                                f'Holdet data is needed to add new players.')
+                continue
+            for column, key in ROUND_STATS_COLUMNS.items():
+                old_value = columns[column][idx]
+                new_value = player['values'][key]
+                if old_value != new_value and not (pd.isna(old_value) and pd.isna(new_value)):
+                    columns[column][idx] = new_value
+                    changes.append({
+                        'player_id': player_id,
+                        'field': column,
+                        'old': old_value.item() if isinstance(old_value, np.generic) else old_value,
+                        'new': new_value
+                    })
+        if len(changes) > 0:
+            self.player_data = players.with_columns(columns)
+        logging.info(f'Refreshed round statistics for game {self.game_id}: {len(changes)} changed values for '
+                     f'{len(set(change["player_id"] for change in changes))} players.')
+        return changes
 
     def get_event_points(self, event_id: int) -> float:
         """Get the amount of points awarded for a given event ID."""
@@ -207,7 +438,7 @@ class HoldetDk:
     def get_current_round_stats(self) -> dict:
         rnd_no = self.get_current_round()
         round_stats = requests.get(
-            f"https://fs-api.swush.com/games/{self.game_id}/rounds/{rnd_no}/statistics?appid=holdet&culture=da")
+            f"{self.stats_api_url}/games/{self.game_id}/rounds/{rnd_no}/statistics?appid=holdet&culture=da")
         game_data_dict = json.loads(round_stats.text)
         return game_data_dict
 
@@ -227,12 +458,13 @@ class ApiFootball:
 
     # TODO: auto find current season.
 
-    def __init__(self, api_key: str, league_id: int = 4, season: int = 2024, bookmaker: str = "Bet365"):
+    def __init__(self, api_key: str, league_id: int = 4, season: int = 2024, bookmaker: str = "Bet365",
+                 base_url: str = None):
             self.api_key = api_key
             self.league_id = league_id
             self.season = season
             self.bookmaker = bookmaker
-            self.base_url = "https://v3.football.api-sports.io"
+            self.base_url = base_url or API_FOOTBALL_URL
             self.headers = {
             'x-rapidapi-host': "v3.football.api-sports.io",
             'x-rapidapi-key': self.api_key
@@ -392,17 +624,170 @@ class ApiFootball:
         }
 
 
-class Stats:
-    """Stats based on qualifiers."""
+NAME_KEY_TRANSLATION = str.maketrans({'ø': 'o', 'æ': 'ae', 'ß': 'ss', 'đ': 'd', 'ł': 'l', 'ı': 'i'})
+
+
+def name_key(name: str, keep_digits: bool = False) -> str:
+    """Normalize a player name for matching names across data sources: lower case, accents removed and only letters
+    (and digits if keep_digits) separated by single spaces, e.g. "Rasmus Højlund" and "Rasmus Hojlund" both give
+    "rasmus hojlund"."""
+
+    decomposed = unicodedata.normalize('NFKD', name.lower().translate(NAME_KEY_TRANSLATION))
+    ascii_name = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^a-z0-9]+' if keep_digits else r'[^a-z]+', ' ', ascii_name).split())
+
+
+class OddsTable:
+    """Flattened, columnar table of api-football odds, with one row per fixture, bookmaker, bet and selection. It is
+    built once from the nested ApiFootball.get_odds payload. The odds of each bookmaker are de-margined and combined
+    into a consensus probability across bookmakers (the median), indexed by fixture, bet and selection name key."""
+
+    EXCLUSIVE_BET_IDS = {1}
+    """Bets whose selections are mutually exclusive and exhaustive, e.g. match winner (Home/Draw/Away). Their odds are
+    de-margined by normalizing the implied probabilities to sum to 1. Other bets, e.g. anytime goalscorer, have no
+    exhaustive set of selections to normalize, so they are only lightly corrected: divided by the overround of the
+    bookmaker's match winner odds for the same fixture, when available. That overround (around 1.05) is much smaller
+    than the margin of an anytime goalscorer market, so their consensus probabilities are still overestimated."""
+
+    def __init__(self, odds: Dict[int, List[Dict]]):
+        rows = [
+            (fixture['fixture']['id'], bookmaker['name'], bet['id'], odd['value'], float(odd['odd']))
+            for bet_id, fixtures in odds.items() if fixtures
+            for fixture in fixtures
+            for bookmaker in fixture['bookmakers']
+            for bet in bookmaker['bets'] if bet['id'] == bet_id
+            for odd in bet['values']
+        ]
+        frame = pd.DataFrame(rows, columns=['fixture_id', 'bookmaker', 'bet_id', 'selection', 'odd'])
+        frame['selection_key'] = [name_key(str(selection)) for selection in frame['selection']]
+        frame['probability'] = self._demargin(frame)
+        self.fixture_id = frame['fixture_id'].to_numpy(dtype=np.int64)
+        self.bookmaker = frame['bookmaker'].to_numpy(dtype=object)
+        self.bet_id = frame['bet_id'].to_numpy(dtype=np.int64)
+        self.selection = frame['selection'].to_numpy(dtype=object)
+        self.selection_key = frame['selection_key'].to_numpy(dtype=object)
+        self.odd = frame['odd'].to_numpy(dtype=np.float64)
+        self.probability = frame['probability'].to_numpy(dtype=np.float64)
+
+        consensus = frame.groupby(['fixture_id', 'bet_id', 'selection_key'])['probability'].median()
+        self._consensus = {}
+        for (fixture_id, bet_id, selection_key), probability in consensus.items():
+            self._consensus.setdefault((fixture_id, bet_id), {})[selection_key] = probability
+
+    def __len__(self) -> int:
+        return len(self.odd)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint of the table in bytes."""
+
+        columns = [self.fixture_id, self.bookmaker, self.bet_id, self.selection, self.selection_key, self.odd,
+                   self.probability]
+        return sum(column_nbytes(column) for column in columns) + sys.getsizeof(self._consensus) + sum(
+            sys.getsizeof(selections) for selections in self._consensus.values()
+        )
+
+    @classmethod
+    def _demargin(cls, frame: pd.DataFrame) -> pd.Series:
+        implied = 1 / frame['odd']
+        overround = implied.groupby([frame['fixture_id'], frame['bookmaker'], frame['bet_id']]).transform('sum')
+        exclusive = frame['bet_id'].isin(cls.EXCLUSIVE_BET_IDS)
+        match_winner_overround = (
+            implied[exclusive]
+            .groupby([frame['fixture_id'][exclusive], frame['bookmaker'][exclusive]])
+            .sum()
+            .rename('match_winner_overround')
+        )
+        other_overround = frame[['fixture_id', 'bookmaker']].join(
+            match_winner_overround, on=['fixture_id', 'bookmaker']
+        )['match_winner_overround'].fillna(1)
+        return implied / overround.where(exclusive, other_overround)
+
+    @property
+    def fixture_ids(self) -> set:
+        return set(self.fixture_id.tolist())
+
+    def get_consensus_probabilities(self, fixture_id: int, bet_id: int) -> Dict[str, float]:
+        """Return the consensus probability by selection name key for a fixture and bet."""
+
+        return self._consensus.get((fixture_id, bet_id), {})
+
+    def get_consensus_probability(self, fixture_id: int, bet_id: int, selection: str) -> float | None:
+        return self.get_consensus_probabilities(fixture_id, bet_id).get(name_key(selection))
+
+
+class Dataset:
+    """A table (e.g. players or teams) of a stats dataset listed in datasets/datasets.json. A compiled table (see
+    compile_datasets.py) is memory-mapped lazily per column, so only the columns that are used are ever read. Without
+    an up-to-date compiled table, the columns are read from the source CSV."""
+
+    def __init__(self, name: str, table: str, columns: List[str] = None):
+        self.name = name
+        self.table = table
+        self.columns_used = columns
+        self.source = os.path.join(DATASETS_DIR, load_datasets_registry()['datasets'][name][table])
+        self.compiled_dir = os.path.join(COMPILED_DATASETS_DIR, name, table)
+        self.manifest = self._load_manifest()
+        self._columns = {}
+        self._csv_loaded = False
+
+    def _load_manifest(self) -> dict | None:
+        manifest_path = os.path.join(self.compiled_dir, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return None
+        if os.path.getmtime(self.source) > os.path.getmtime(manifest_path):
+            logging.warning(f'Compiled dataset {self.name}/{self.table} is older than {self.source} and is not used. '
+                            f'Run compile_datasets.py to update it.')
+            return None
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    def get(self, column: str) -> np.ndarray | None:
+        """Return a column, or None if the table does not have it."""
+
+        if column not in self._columns:
+            if self.manifest is not None:
+                if column not in self.manifest['columns']:
+                    return None
+                self._columns[column] = np.load(
+                    os.path.join(self.compiled_dir, self.manifest['columns'][column]['file']), mmap_mode='r'
+                )
+            elif not self._csv_loaded:
+                frame = pd.read_csv(self.source, usecols=self.columns_used)
+                self._columns.update({name: frame[name].to_numpy() for name in frame.columns})
+                self._csv_loaded = True
+        return self._columns.get(column)
 
-    def __init__(self):
-        self.data_players = self.load_data_players()
-        self.data_teams = self.load_data_teams()
+
+class Stats:
+    """Stats based on qualifiers. The dataset is selected by name from datasets/datasets.json, by default from the
+    STATS_DATASET environment variable or else the default dataset of datasets.json."""
+
+    PLAYER_COLUMNS = [
+        'full_name',
+        'min_per_match',
+        'goals_per_90_overall',
+        'assists_per_90_overall',
+        'cards_per_90_overall',
+        'appearances_overall',
+        'clean_sheets_overall',
+    ]
+    """Columns of the players table that are used. The compiled players table is pruned to these."""
+
+    def __init__(self, dataset: str = None):
+        self.dataset = dataset or os.environ.get('STATS_DATASET') or load_datasets_registry()['default']
+        self.data_players = Dataset(self.dataset, 'players', columns=self.PLAYER_COLUMNS)
+        self.data_teams = Dataset(self.dataset, 'teams')
+        self._stat_players = {}
 
     def get_stat_players(self, column_name: str) -> dict:
         """Return dict of player_full_name: statistic."""
 
-        return dict(zip(self.data_players.get('full_name'), self.data_players.get(column_name)))
+        if column_name not in self._stat_players:
+            self._stat_players[column_name] = dict(zip(
+                self.data_players.get('full_name').tolist(), self.data_players.get(column_name).tolist()
+            ))
+        return self._stat_players[column_name]
 
     def get_prob_appearance(self) -> dict:
         """Return the probability of appearance based on minutes_per_match / 90."""
@@ -410,14 +795,6 @@ class Stats:
         min_per_match = self.get_stat_players('min_per_match')
         return {i: m / 90 for i, m in min_per_match.items()}
 
-    @staticmethod
-    def load_data_players():
-        return pd.read_csv('datasets/footystats_euro2024_qualifiers_players.csv')
-
-    @staticmethod
-    def load_data_teams():
-        return pd.read_csv('datasets/footystats_euro2024_qualifiers_teams.csv')
-
 #
 # class Stats(ApiFootball):
 #     """Stats based on qualifiers."""
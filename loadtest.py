@@ -0,0 +1,380 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import itertools
+import threading
+import subprocess
+import datetime as dt
+import numpy as np
+import pandas as pd
+import requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from typing import List, Tuple, Callable
+
+from data import GAMES, DEFAULT_GAME, EVENTS, Stats
+from benchmarks import generate_holdet_payload
+
+
+class StubConfig:
+    """Behaviour of a stub server: latency added to every response and portion of requests answered with HTTP 500."""
+
+    def __init__(self, latency_seconds: float = 0.05, error_rate: float = 0.0):
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+
+
+class StubServer:
+    """Local HTTP server answering GET requests with JSON payloads, mimicking an upstream API. Routes are (path regex,
+    function of the path match and the query parameters returning the payload). Runs in a background thread."""
+
+    def __init__(self, name: str, routes: List[Tuple[str, Callable]], config: StubConfig, seed: int = 0):
+        self.name = name
+        self.routes = [(re.compile(pattern), payload) for pattern, payload in routes]
+        self.config = config
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._encoded = {}
+        self._server = None
+
+    def _respond(self, url: str) -> Tuple[int, bytes]:
+        with self._lock:
+            self.requests += 1
+            fail = self._random.random() < self.config.error_rate
+            if fail:
+                self.errors += 1
+        time.sleep(self.config.latency_seconds)
+        if fail:
+            return 500, b'{"message": "Stub error"}'
+        if url not in self._encoded:
+            path = urlsplit(url)
+            query = {key: values[0] for key, values in parse_qs(path.query).items()}
+            for pattern, payload in self.routes:
+                match = pattern.fullmatch(path.path)
+                if match:
+                    self._encoded[url] = json.dumps(payload(match, query)).encode()
+                    break
+            else:
+                return 404, b'{"message": "Not found"}'
+        return 200, self._encoded[url]
+
+    def start(self) -> str:
+        """Start the server on a free local port and return its base URL."""
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = stub._respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def generate_stub_payloads(game: dict, n_players: int = 600, n_bookmakers: int = 3, seed: int = 0) -> (dict, dict):
+    """Generate Holdet and api-football payloads of a round that is open now, for the stub servers. Player names are
+    taken from the game's stats dataset, most appearances first, so the players are matched like real players. The
+    payload size grows with the number of players and bookmakers."""
+
+    rnd = random.Random(seed)
+    prob_appearance = Stats(dataset=game['stats_dataset']).get_prob_appearance()
+    names = sorted(prob_appearance, key=prob_appearance.get, reverse=True)[:n_players]
+    names += [f"First{i} Last{i}" for i in range(len(names), n_players)]
+    team_id_map = game['team_id_map']
+    now = dt.datetime.now(dt.timezone.utc).replace(microsecond=0)
+    current_round = {
+        'start': (now - dt.timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'close': (now + dt.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'end': (now + dt.timedelta(days=3)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+    }
+    holdet = generate_holdet_payload(
+        n_players, seed=seed, names=names, team_ids=list(team_id_map.keys()), rounds=[current_round]
+    )
+
+    persons = {person['id']: person for person in holdet['tournament']['persons']}
+    players_by_team = {}
+    for player in holdet['tournament']['players']:
+        person = persons[player['person']['id']]
+        players_by_team.setdefault(team_id_map[player['team']['id']], []).append(
+            f"{person['firstname']} {person['lastname']}"
+        )
+    api_team_ids = list(team_id_map.values())
+    bookmakers = ['Bet365'] + [f"Bookmaker {i}" for i in range(1, n_bookmakers)]
+    fixtures, predictions, odds = [], {}, {bet_id: [] for bet_id in set(event['bet_id'] for event in EVENTS.values())}
+    for i in range(0, len(api_team_ids) - 1, 2):
+        teams = {'home': {'id': api_team_ids[i]}, 'away': {'id': api_team_ids[i + 1]}}
+        fixture = {'id': 1_000_000 + i, 'date': (now + dt.timedelta(hours=2 + i)).isoformat()}
+        fixtures.append({'fixture': fixture, 'teams': teams})
+        p_home = rnd.uniform(0.2, 0.6)
+        p_away = 0.75 - p_home
+        predictions[fixture['id']] = [{
+            'predictions': {'percent': {'home': f"{p_home:.0%}", 'draw': '25%', 'away': f"{p_away:.0%}"}},
+            'teams': teams,
+        }]
+        goalscorers = players_by_team.get(teams['home']['id'], []) + players_by_team.get(teams['away']['id'], [])
+        for bet_id in odds:
+            fixture_bookmakers = []
+            for bookmaker in bookmakers:
+                margin = 1 + rnd.uniform(0.02, 0.08)
+                if bet_id == 1:
+                    values = [('Home', p_home), ('Draw', 0.25), ('Away', p_away)]
+                else:
+                    values = [(name, rnd.uniform(0.05, 0.5)) for name in goalscorers]
+                fixture_bookmakers.append({'name': bookmaker, 'bets': [{'id': bet_id, 'values': [
+                    {'value': value, 'odd': f"{1 / (probability * margin):.2f}"} for value, probability in values
+                ]}]})
+            odds[bet_id].append({'fixture': fixture, 'bookmakers': fixture_bookmakers})
+    api_football = {'fixtures': fixtures, 'predictions': predictions, 'odds': odds, 'injuries': []}
+    return holdet, api_football
+
+
+def start_stub_servers(
+        holdet_payload: dict,
+        api_football_payload: dict,
+        holdet_config: StubConfig,
+        swush_config: StubConfig,
+        api_football_config: StubConfig
+) -> List[Tuple[StubServer, str]]:
+    """Start stub servers for api.holdet.dk, fs-api.swush.com and v3.football.api-sports.io. Returns the servers and
+    their base URLs."""
+
+    def api_football_response(response):
+        return {'errors': [], 'response': response}
+
+    servers = [
+        StubServer('holdet', [
+            (r'/catalog/games/\d+', lambda match, query: holdet_payload['game']),
+            (r'/tournaments/\d+', lambda match, query: holdet_payload['tournament']),
+            (r'/rulesets/\d+', lambda match, query: holdet_payload['ruleset']),
+        ], holdet_config, seed=1),
+        StubServer('swush', [
+            (r'/games/\d+/rounds/\d+/statistics', lambda match, query: holdet_payload['round_stats']),
+        ], swush_config, seed=2),
+        StubServer('api_football', [
+            (r'/fixtures', lambda match, query: api_football_response(api_football_payload['fixtures'])),
+            (r'/injuries', lambda match, query: api_football_response(api_football_payload['injuries'])),
+            (r'/odds', lambda match, query: api_football_response(api_football_payload['odds'][int(query['bet'])])),
+            (r'/predictions', lambda match, query: api_football_response(
+                api_football_payload['predictions'][int(query['fixture'])]
+            )),
+        ], api_football_config, seed=3),
+    ]
+    return [(server, server.start()) for server in servers]
+
+
+APP_SERVER_CODE = """
+from werkzeug.serving import make_server
+import main
+make_server('127.0.0.1', {port}, main.app, threaded=True).serve_forever()
+"""
+"""Runs the Flask app of main.py with a threaded server in a new Python process."""
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _virtual_user(
+        url: str,
+        deadline: float,
+        seed: int,
+        latencies: list,
+        errors: list,
+        posted_forms: list,
+        repeat_portion: float,
+        repeats: list
+):
+    """Post team forms to url until the deadline, like a user of the app: fetch the form once for the CSRF token and
+    session cookie, then post with varying cash holdings and weights. A repeat_portion of the posts repeat a form posted
+    before by any user (posted_forms), which the app answers from its solve cache. Records the latency of each post,
+    whether it was a repeat, and the failed posts."""
+
+    rnd = random.Random(seed)
+    session = requests.Session()
+    csrf_token = None
+    while csrf_token is None and time.monotonic() < deadline:
+        response = session.get(url)
+        match = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', response.text)
+        if response.status_code == 200 and match:
+            csrf_token = match.group(1)
+        else:
+            errors.append(response.status_code)
+    while time.monotonic() < deadline:
+        repeat = len(posted_forms) > 0 and rnd.random() < repeat_portion
+        if repeat:
+            inputs = rnd.choice(posted_forms)
+        else:
+            # Cash holdings vary in steps of 1000, so new forms practically never repeat an earlier form.
+            inputs = {
+                'bank_beholdning': rnd.randrange(40_000_000, 60_000_000, 1_000),
+                **{field: rnd.choice([0.5, 1]) for field in [
+                    'weight_team_win', 'weight_player_goals', 'weight_player_assists', 'weight_player_cards',
+                    'weight_player_clean_sheets'
+                ]},
+            }
+        start = time.perf_counter()
+        response = session.post(url, data={'csrf_token': csrf_token, 'player_ids': '', **inputs})
+        latencies.append(time.perf_counter() - start)
+        repeats.append(repeat)
+        if response.status_code != 200 or 'Optimal Team' not in response.text:
+            errors.append(response.status_code)
+        elif not repeat:
+            posted_forms.append(inputs)
+
+
+class LoadTestConfig:
+    """A load test configuration: number of concurrent virtual users, duration, generated payload size (players and
+    bookmakers), the behaviour of each stub server and the portion of posts repeating an earlier form (solve cache
+    hits)."""
+
+    def __init__(
+            self,
+            users: int = 4,
+            duration_seconds: float = 30,
+            n_players: int = 600,
+            n_bookmakers: int = 3,
+            holdet: StubConfig = None,
+            swush: StubConfig = None,
+            api_football: StubConfig = None,
+            game: str = DEFAULT_GAME,
+            repeat_portion: float = 0.0
+    ):
+        self.users = users
+        self.duration_seconds = duration_seconds
+        self.n_players = n_players
+        self.n_bookmakers = n_bookmakers
+        self.holdet = holdet or StubConfig()
+        self.swush = swush or StubConfig()
+        self.api_football = api_football or StubConfig()
+        self.game = game
+        self.repeat_portion = repeat_portion
+
+
+def run_load_test(config: LoadTestConfig) -> dict:
+    """Start the stub servers and the app in a separate process, wait for the app's warmup request and drive the
+    game's index route with concurrent virtual users. The app gets an empty solve cache, so only repeated forms are
+    cache hits. Returns latency percentiles, the cache hit ratio, throughput and error counts."""
+
+    holdet_payload, api_football_payload = generate_stub_payloads(
+        GAMES[config.game], config.n_players, config.n_bookmakers
+    )
+    stubs = start_stub_servers(holdet_payload, api_football_payload, config.holdet, config.swush, config.api_football)
+    env = dict(zip(['HOLDET_API_URL', 'SWUSH_API_URL', 'API_FOOTBALL_URL'], [url for _, url in stubs]))
+    port = _free_port()
+    solve_cache_dir = tempfile.TemporaryDirectory()
+    # The app runs in a new process, so data.py reads the stub base URLs from the environment at import.
+    app_process = subprocess.Popen(
+        [sys.executable, "-c", APP_SERVER_CODE.format(port=port)],
+        env={**os.environ, **env, 'SOLVE_CACHE_DIR': solve_cache_dir.name},
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        # Wait for the app to start and load the round context (retried, as stub errors can fail the warmup).
+        warmup_deadline = time.monotonic() + 120
+        while True:
+            try:
+                if requests.get(f"{base_url}/_ah/warmup").status_code == 200:
+                    break
+            except requests.ConnectionError:
+                pass
+            if time.monotonic() > warmup_deadline:
+                raise Exception("The app did not warm up within 120 seconds.")
+            time.sleep(0.2)
+
+        latencies, errors, posted_forms, repeats = [], [], [], []
+        deadline = time.monotonic() + config.duration_seconds
+        users = [
+            threading.Thread(target=_virtual_user, args=(
+                f"{base_url}/{config.game}/", deadline, seed, latencies, errors, posted_forms, config.repeat_portion,
+                repeats
+            ))
+            for seed in range(config.users)
+        ]
+        start = time.perf_counter()
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        seconds = time.perf_counter() - start
+    finally:
+        app_process.terminate()
+        app_process.wait()
+        for server, _ in stubs:
+            server.stop()
+        solve_cache_dir.cleanup()
+
+    return {
+        'users': config.users,
+        'players': config.n_players,
+        'bookmakers': config.n_bookmakers,
+        'latency_s': config.api_football.latency_seconds,
+        'error_rate': config.api_football.error_rate,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'p50_ms': np.percentile(latencies, 50) * 1000 if latencies else None,
+        'p95_ms': np.percentile(latencies, 95) * 1000 if latencies else None,
+        'p99_ms': np.percentile(latencies, 99) * 1000 if latencies else None,
+        'cache_hit_ratio': np.mean(repeats) if repeats else None,
+        'throughput_rps': (len(latencies) - len(errors)) / seconds,
+        **{f"{server.name}_requests": server.requests for server, _ in stubs},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test the app against local stub servers of Holdet, swush and api-football. Runs every "
+                    "combination of the given users, latencies and error rates (the latency and error rate apply to "
+                    "all stub servers)."
+    )
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4], help="Concurrent virtual users.")
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.05], help="Stub latency in seconds.")
+    parser.add_argument("--error-rate", type=float, nargs="+", default=[0.0], help="Stub error rate (0 to 1).")
+    parser.add_argument("--players", type=int, default=600, help="Number of players in the stub payloads.")
+    parser.add_argument("--bookmakers", type=int, default=3, help="Number of bookmakers in the stub odds.")
+    parser.add_argument("--duration", type=float, default=30, help="Duration of each configuration in seconds.")
+    parser.add_argument("--repeat-portion", type=float, default=0.0,
+                        help="Portion of posts repeating an earlier form, answered from the solve cache (0 to 1).")
+    args = parser.parse_args()
+
+    rows = []
+    for users, latency, error_rate in itertools.product(args.users, args.latency, args.error_rate):
+        stub_config = StubConfig(latency_seconds=latency, error_rate=error_rate)
+        rows.append(run_load_test(LoadTestConfig(
+            users=users,
+            duration_seconds=args.duration,
+            n_players=args.players,
+            n_bookmakers=args.bookmakers,
+            holdet=stub_config,
+            swush=stub_config,
+            api_football=stub_config,
+            repeat_portion=args.repeat_portion
+        )))
+        print(pd.DataFrame(rows[-1:]).to_string(index=False))
+        sys.stdout.flush()
+    print(pd.DataFrame(rows).to_string(index=False))
@@ -1,15 +1,22 @@
-import pandas as pd
+import time
+
+_import_start = time.perf_counter()
+
+import os
+import logging
 import secrets
-from flask import Flask, render_template
+import hashlib
+import threading
+from flask import Flask, render_template, request, g, abort, jsonify
 from flask_caching import Cache
 from flask_bootstrap import Bootstrap5
 from flask_wtf import FlaskForm, CSRFProtect
-from wtforms import SubmitField, SelectMultipleField, FloatField
+from wtforms import Field, SubmitField, FloatField
 from wtforms.validators import DataRequired, ValidationError, NumberRange
-from wtforms.widgets import html_params
-from markupsafe import Markup
-from data import ApiFootball, HoldetDk, Stats, TEAM_ID_MAP, EVENTS
-from optimization import Optimization, OptimizationInput
+from wtforms.widgets import HiddenInput
+
+# pandas, mip, thefuzz and the data and optimization modules are imported on first use (see warmup), to keep the cold
+# start of an App Engine instance fast.
 
 app = Flask(__name__)
 cache = Cache(app, config={'CACHE_TYPE': 'simple'})
@@ -20,71 +27,47 @@ app.secret_key = foo
 
 API_FOOTBALL_KEY = "bf198eceb1b289cd1d865352a470f77f"
 
+OPTIMIZATION_SETTINGS = {
+    'min_prob_appear': 0.80,
+    'min_spend_portion': 0.95,
+    'transfer_cost_rate': 0.01,
+    'max_seconds': 30,
+    # Weight of the forecast player value growth (see value_history.py) in the objective, off by default.
+    'weight_value_growth': 0,
+}
 
-# TODO: add chatgpt based "feedback from assistant coach".
-
-# Custom widget for multi-checkbox field
-class CustomCheckboxWidget(object):
-    def __call__(self, field, **kwargs):
-        kwargs.setdefault('type', 'checkbox')
-        field_id = kwargs.pop('id', field.id)
-        html = [Markup('<br><br>')]
-        for value, label, checked, _ in field.iter_choices():
-            choice_id = f"{field_id}-{value}"
-            options = dict(kwargs, name=field.name, value=value, id=choice_id)
-            if checked:
-                options['checked'] = 'checked'
-            html.append(Markup('<input %s /> ' % html_params(**options)))
-            html.append(Markup('<label for="%s">%s</label><br>' % (choice_id, label)))
-        return Markup(''.join(html))
-
-
-# Custom multi-checkbox field
-class MultiCheckboxField(SelectMultipleField):
-    widget = CustomCheckboxWidget()
-    option_widget = None
+# Race a portfolio of solver configurations in parallel processes per request on multi-core instances (see
+# portfolio.py). Off by default, as every portfolio solve uses a process per core. At most
+# SOLVER_PORTFOLIO_MAX_CONCURRENT requests race a portfolio at a time, other requests solve in process.
+SOLVER_PORTFOLIO = os.environ.get('SOLVER_PORTFOLIO', '0') == '1'
+SOLVER_PORTFOLIO_MAX_CONCURRENT = int(os.environ.get('SOLVER_PORTFOLIO_MAX_CONCURRENT', 1))
+_portfolio_slots = threading.BoundedSemaphore(SOLVER_PORTFOLIO_MAX_CONCURRENT)
 
 
-def get_api_football_data():
-    return ApiFootball(API_FOOTBALL_KEY)
+# TODO: add chatgpt based "feedback from assistant coach".
 
+class PlayerIdsField(Field):
+    """Player IDs, posted as a comma separated list in a hidden input that is filled in by the player picker in
+    static/script.js."""
 
-def get_holdet_data():
-    return HoldetDk()
+    widget = HiddenInput()
 
+    def _value(self):
+        return ','.join(str(player_id) for player_id in self.data) if self.data else ''
 
-def get_player_names():
-    data = get_holdet_data()
-    return [(player['player_id'], player['person_fullname']) for player in data.player_data]
+    def process_formdata(self, valuelist):
+        self.data = []
+        if valuelist and valuelist[0].strip():
+            try:
+                self.data = list(dict.fromkeys(int(player_id) for player_id in valuelist[0].split(',')))
+            except ValueError:
+                raise ValueError('Invalid player IDs.')
 
 
-def get_data(
-        existing_player_ids: list,
-        bank_beholdning: float,
-        weight_team_win: float,
-        weight_player_goals: float,
-        weight_player_assists: float,
-        weight_player_cards: float,
-        weight_player_clean_sheets: float
-):
-    odds_data = get_api_football_data()
-    holdet_data = get_holdet_data()
-    stats = Stats()
-    optimization_input = OptimizationInput(
-        holdet=holdet_data,
-        api_football=odds_data,
-        stats=stats,
-        existing_player_ids=existing_player_ids,
-        bank_beholdning=bank_beholdning,
-        weight_team_win=weight_team_win,
-        weight_player_goals=weight_player_goals,
-        weight_player_assists=weight_player_assists,
-        weight_player_cards=weight_player_cards,
-        weight_player_clean_sheets=weight_player_clean_sheets,
-        team_id_map=TEAM_ID_MAP,
-        events=EVENTS
-    )
-    return optimization_input
+def get_round_context(game: str = None):
+    from context import get_round_context
+    from data import DEFAULT_GAME
+    return get_round_context(API_FOOTBALL_KEY, game or DEFAULT_GAME)
 
 
 def validate_selection_count(form, field):
@@ -92,12 +75,18 @@ def validate_selection_count(form, field):
         raise ValidationError('You must select either 0 or 11 players.')
 
 
+def validate_known_players(form, field):
+    unknown_player_ids = [player_id for player_id in field.data if player_id not in form.known_player_ids]
+    if len(unknown_player_ids) > 0:
+        raise ValidationError(f'Unknown player IDs: {", ".join(str(player_id) for player_id in unknown_player_ids)}.')
+
+
 class TeamForm(FlaskForm):
-    def __init__(self, choices, *args, **kwargs):
+    def __init__(self, known_player_ids, *args, **kwargs):
         super(TeamForm, self).__init__(*args, **kwargs)
-        self.options.choices = choices
+        self.known_player_ids = known_player_ids
 
-    options = MultiCheckboxField('Select existing team:', validators=[validate_selection_count])
+    player_ids = PlayerIdsField('Select existing team:', validators=[validate_selection_count, validate_known_players])
     bank_beholdning = FloatField('Cash holding', validators=[DataRequired()])
 
     weight_team_win = FloatField('Team win', default=1, validators=[DataRequired(), NumberRange(min=0, max=1)])
@@ -116,49 +105,186 @@ def get_optimal_team_df(
         weight_player_goals: float,
         weight_player_assists: float,
         weight_player_cards: float,
-        weight_player_clean_sheets: float
+        weight_player_clean_sheets: float,
+        game: str = None,
+        use_cache: bool = True,
+        solve_info: dict = None
 ):
-    optimization_input = get_data(
-        existing_player_ids,
-        bank_beholdning,
-        weight_team_win,
-        weight_player_goals,
-        weight_player_assists,
-        weight_player_cards,
-        weight_player_clean_sheets
+    """Returns the optimal team as a DataFrame. With use_cache False the solve cache is bypassed, e.g. for a profiled
+    request. solve_info, if given, is filled with how the team was found: solve_cache ('hit', 'miss' or 'bypassed')
+    and solver_portfolio (whether a solver portfolio was raced in other processes)."""
+
+    import pandas as pd
+    from optimization import Optimization
+    from portfolio import DEFAULT_PORTFOLIO
+    from solve_cache import solve_cache_key
+
+    # Identical submissions (e.g. an empty team with the default weights) are solved once per round data version. The
+    # key and the input are taken from the same context, without refreshing it in between.
+    context = get_round_context(game)
+    data_version = context.data_version
+    cache_key = solve_cache_key(
+        data_version=data_version,
+        existing_player_ids=existing_player_ids,
+        bank_beholdning=bank_beholdning,
+        weights={
+            'team_win': weight_team_win,
+            'player_goals': weight_player_goals,
+            'player_assists': weight_player_assists,
+            'player_cards': weight_player_cards,
+            'player_clean_sheets': weight_player_clean_sheets,
+        },
+        solver_settings=OPTIMIZATION_SETTINGS
     )
-    optimization = Optimization(optimization_input)
-    optimization.build_model()
-    optimization.run()
+    solve_info = solve_info if solve_info is not None else {}
+    optimal_team_df = context.solve_cache.get(cache_key) if use_cache else None
+    solve_info.update(solve_cache='hit' if optimal_team_df is not None else 'miss' if use_cache else 'bypassed',
+                      solver_portfolio=False)
+    if optimal_team_df is not None:
+        return optimal_team_df
+
+    optimization_input = context.get_optimization_input(
+        existing_player_ids=existing_player_ids,
+        bank_beholdning=bank_beholdning,
+        weight_team_win=weight_team_win,
+        weight_player_goals=weight_player_goals,
+        weight_player_assists=weight_player_assists,
+        weight_player_cards=weight_player_cards,
+        weight_player_clean_sheets=weight_player_clean_sheets
+    )
+    cpu_count = os.cpu_count() or 1
+    use_portfolio = SOLVER_PORTFOLIO and cpu_count > 1 and _portfolio_slots.acquire(blocking=False)
+    solve_info['solver_portfolio'] = use_portfolio
+    try:
+        optimization = Optimization(
+            optimization_input,
+            **OPTIMIZATION_SETTINGS,
+            solver_configs=DEFAULT_PORTFOLIO[:cpu_count] if use_portfolio else None
+        )
+        optimization.build_model()
+        optimization.run()
+    finally:
+        if use_portfolio:
+            _portfolio_slots.release()
     r = optimization.get_result()
     optimal_team_df = pd.DataFrame(r['optimal_team'])
     # Order by position
     sort_order = {'Goalkeeper': 0, 'Defense': 1, 'Midfielder': 2, 'Striker': 3}
     optimal_team_df.sort_values(by=['position_name_en'], key=lambda x: x.map(sort_order), inplace=True)
+    # Not cached if the context was refreshed by another request while building the input.
+    if optimization_input.data_version == data_version:
+        context.solve_cache.set(cache_key, optimal_team_df)
     return optimal_team_df
 
 
+@app.route('/_ah/warmup')
+def warmup():
+    """App Engine warmup request. Imports the heavy modules, loads the CBC library and the round context of the default
+    game before the instance receives traffic."""
+
+    start = time.perf_counter()
+    import pandas  # noqa: F401
+    import mip
+    mip.Model(solver_name=mip.CBC)  # Loads the CBC shared library
+    get_round_context()
+    logging.info(f'Warmup done in {(time.perf_counter() - start) * 1000:.0f} ms.')
+    return '', 200, {}
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+_first_request_logged = False
+
+
+@app.after_request
+def log_first_request_latency(response):
+    global _first_request_logged
+    if not _first_request_logged and request.path != '/_ah/warmup':
+        _first_request_logged = True
+        logging.info(f'First request {request.method} {request.path} served in '
+                     f'{(time.perf_counter() - g.request_start) * 1000:.0f} ms.')
+    return response
+
+
 @app.route('/', methods=['GET', 'POST'])
-def index():
+@app.route('/<game>/', methods=['GET', 'POST'])
+def index(game: str = None):
+    from data import GAMES, DEFAULT_GAME
+
+    game = game or DEFAULT_GAME
+    if game not in GAMES:
+        abort(404)
+    from profiling import RequestProfiler
+
     optimal_team_table = None
-    choices = get_player_names()
-    team_form = TeamForm(choices=choices)
-
-    if team_form.validate_on_submit():
-        # Calc optimal team and render
-        optimal_team_df = get_optimal_team_df(
-            existing_player_ids=[int(p_id) for p_id in team_form.options.data],
-            bank_beholdning=team_form.bank_beholdning.data,
-            weight_team_win=team_form.weight_team_win.data,
-            weight_player_goals=team_form.weight_player_goals.data,
-            weight_player_assists=team_form.weight_player_assists.data,
-            weight_player_cards=team_form.weight_player_cards.data,
-            weight_player_clean_sheets=team_form.weight_player_clean_sheets.data
-        )
-        optimal_team_table = optimal_team_df.to_html(classes='table table-striped', escape=False, index=False)
+    # Form posts are profiled on demand (admin header) or by sampling, see profiling.py, from the round data fetch on.
+    # Profiled requests bypass the solve cache. A solver portfolio solves in other processes, which are not profiled.
+    with RequestProfiler(request.headers, eligible=request.method == 'POST') as profiler:
+        context = get_round_context(game)
+        team_form = TeamForm(known_player_ids=set(context.holdet.player_data.column('player_id').tolist()))
+
+        if team_form.validate_on_submit():
+            # Calc optimal team and render
+            inputs = dict(
+                existing_player_ids=team_form.player_ids.data,
+                bank_beholdning=team_form.bank_beholdning.data,
+                weight_team_win=team_form.weight_team_win.data,
+                weight_player_goals=team_form.weight_player_goals.data,
+                weight_player_assists=team_form.weight_player_assists.data,
+                weight_player_cards=team_form.weight_player_cards.data,
+                weight_player_clean_sheets=team_form.weight_player_clean_sheets.data,
+                game=game
+            )
+            profiler.inputs = inputs
+            profiler.metadata['data_version'] = context.data_version
+            optimal_team_df = get_optimal_team_df(
+                **inputs, use_cache=not profiler.enabled, solve_info=profiler.metadata
+            )
+            optimal_team_table = optimal_team_df.to_html(classes='table table-striped', escape=False, index=False)
+
+    return render_template('index.html', team_form=team_form, optimal_team_table=optimal_team_table, game=game,
+                           games=GAMES)
+
+
+@app.route('/players/search')
+@app.route('/<game>/players/search')
+def player_search(game: str = None):
+    """JSON player search for the squad picker. Query parameters: q (prefixes of name, team and position words),
+    position (English position name), ids (comma separated player IDs), page and per_page. Responses carry an ETag of
+    the round data version and the query, so unchanged results are answered with 304 Not Modified."""
+
+    from data import GAMES, DEFAULT_GAME
+
+    game = game or DEFAULT_GAME
+    if game not in GAMES:
+        abort(404)
+    query = request.args.get('q', '')
+    position = request.args.get('position') or None
+    try:
+        player_ids = [int(player_id) for player_id in request.args['ids'].split(',')] if request.args.get('ids') \
+            else None
+    except ValueError:
+        abort(400)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 25, type=int), 1), 100)
+
+    context = get_round_context(game)
+    etag = hashlib.sha1(
+        f"{context.data_version}|{query}|{position}|{player_ids}|{page}|{per_page}".encode()
+    ).hexdigest()
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(context.get_search_index().search_page(query, position, player_ids, page, per_page))
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
-    return render_template('index.html', team_form=team_form, optimal_team_table=optimal_team_table)
 
+logging.info(f'main imported in {(time.perf_counter() - _import_start) * 1000:.0f} ms.')
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080)
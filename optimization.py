@@ -1,10 +1,27 @@
 import mip
+import time
+import logging
+import threading
+import numpy as np
 import datetime as dt
 from enum import Enum
 from thefuzz import fuzz
-from typing import List
+from typing import List, Dict, Tuple
 
-from data import HoldetDk, ApiFootball, EVENTS, Stats
+from data import HoldetDk, ApiFootball, EVENTS, Stats, PlayerTable, OddsTable, name_key
+from portfolio import SolverConfig, solve_portfolio
+
+
+TEAM_SIZE = 11
+
+MAX_PLAYERS_PER_POSITION = {"Mål": 1, "Forsvar": 5, "Midtbane": 5, "Angreb": 3}
+"""Most players of each position in a team, by position_name."""
+
+MAX_PLAYERS_PER_TEAM = 4
+
+_cbc_lock = threading.Lock()
+"""Serializes the CBC solves of a process: CBC parses its parameters in shared state, so solves in concurrent threads
+(e.g. of a threaded app server) corrupt each other's parameters and find no solution."""
 
 
 class ProbabilitySource(Enum):
@@ -29,8 +46,18 @@ class OptimizationInput:
             weight_player_goals: float,
             weight_player_assists: float,
             weight_player_cards: float,
-            weight_player_clean_sheets: float
+            weight_player_clean_sheets: float,
+            odds: dict = None,
+            predictions: dict = None,
+            odds_table: OddsTable = None,
+            players: PlayerTable = None,
+            injuries: list = None,
+            data_version: str = None
     ):
+        """Odds and predictions for the current round are fetched from api_football unless given. The odds table is
+        built from the odds and the players are scored unless given. Injuries are fetched when needed unless given.
+        data_version is the version of the round data the input is built from (see RoundContext), if known."""
+
         self.holdet = holdet
         self.api_football = api_football
         self.stats = stats
@@ -43,30 +70,54 @@ class OptimizationInput:
         self.weight_player_assists = weight_player_assists
         self.weight_player_cards = weight_player_cards
         self.weight_player_clean_sheets = weight_player_clean_sheets
-        self.odds = api_football.get_odds(
+        self.odds = odds if odds is not None else api_football.get_odds(
             bet_ids=list(set([event['bet_id'] for i, event in EVENTS.items()])),
             latest_fixture_time_utc=self.holdet.current_round_start_end_time[1]
         )
-        self.predictions = self.api_football.get_fixture_predictions(
+        self.predictions = predictions if predictions is not None else self.api_football.get_fixture_predictions(
             earliest_fixture_time_utc=self.holdet.current_round_start_end_time[0],
             latest_fixture_time_utc=self.holdet.current_round_start_end_time[1]
         )
-        self.players = self._get_expected_player_scores()
-
-    def _calc_expected_score_anytime_goal(self, player) -> float:
-        """Calculate and return the expected score for a player for the event types anytime_goal_% (there is one for
-        each player position)."""
-
-        # TODO: consider adding some score (perhaps min) for each player in team not having an odd (not all players have
-        #   odds)
-        pos_name = player["position_name_en"].lower()
-        return sum(
-            1 / float(player_odd['odd']) for odds in [
-                odd_data['bets'][0]['values'] for fixture in
-                self.odds[self.events[f'anytime_goal_{pos_name}']['bet_id']] for odd_data in
-                fixture['bookmakers'] if odd_data["name"] == self.api_football.bookmaker
-            ] for player_odd in odds if fuzz.ratio(player_odd['value'], player['person_fullname']) > 80
-        ) * self.holdet.get_event_points(self.events[f'anytime_goal_{pos_name}']['holdet_event_id'])
+        self.odds_table = odds_table if odds_table is not None else OddsTable(self.odds)
+        self.injuries = injuries
+        self.data_version = data_version
+        self._team_fixtures = None
+        self.players = players if players is not None else self._get_expected_player_scores()
+
+    def _get_team_fixtures(self) -> Dict[int, List[Tuple[int, str]]]:
+        """Return (fixture ID, "home" or "away") of the fixtures with odds by api-football team ID."""
+
+        if self._team_fixtures is None:
+            fixture_ids = self.odds_table.fixture_ids
+            team_fixtures = {}
+            for fixture in self.api_football.fixtures:
+                if fixture['fixture']['id'] in fixture_ids:
+                    for side in ('home', 'away'):
+                        team_fixtures.setdefault(fixture['teams'][side]['id'], []).append(
+                            (fixture['fixture']['id'], side)
+                        )
+            self._team_fixtures = team_fixtures
+        return self._team_fixtures
+
+    def _get_anytime_goal_probability(self, player, bet_id: int) -> float | None:
+        """Return the sum of consensus anytime goal probabilities for a player over the fixtures of the player's team,
+        or None if the player has no anytime goal odds (not all players have odds). The player is joined to the odds by
+        the name key of the full or short name, falling back to a fuzzy match against the selections of the team's
+        fixtures only."""
+
+        player_keys = (name_key(player['person_fullname']), name_key(player['person_shortname']))
+        prob_sum = None
+        for fixture_id, side in self._get_team_fixtures().get(self.team_id_map.get(player['team_id']), []):
+            selections = self.odds_table.get_consensus_probabilities(fixture_id, bet_id)
+            prob = next((selections[key] for key in player_keys if key in selections), None)
+            if prob is None:
+                prob = next(
+                    (p for selection_key, p in selections.items() if fuzz.ratio(selection_key, player_keys[0]) > 80),
+                    None
+                )
+            if prob is not None:
+                prob_sum = (prob_sum or 0) + prob
+        return prob_sum
 
     def _calc_expected_score_match_winner(
             self, player, prob_source: ProbabilitySource = ProbabilitySource.PREDICTIONS
@@ -74,39 +125,10 @@ class OptimizationInput:
         """Calculate and return the expected score for a player for the event type match_winner."""
 
         if prob_source == ProbabilitySource.ODDS:
-            match_winner_odds = self.odds[self.events['match_winner']['bet_id']]
-
-            fixture_home_away_ids = {
-                fixture["fixture"]['id']: (
-                    fixture_data["teams"]["home"]["id"],
-                    fixture_data["teams"]["away"]["id"]
-                )
-                for fixture in match_winner_odds
-                for fixture_data in self.api_football.fixtures if fixture_data["fixture"]['id'] == fixture["fixture"]["id"]
-            }
+            bet_id = self.events['match_winner']['bet_id']
             prob_sum = sum(
-                [
-                    1 / [
-                        [
-                            float(odd["odd"]) for odd in odd_data["bets"][0]["values"] if odd["value"] == "Home"
-                        ][0]
-                        for odd_data in fixture["bookmakers"]
-                        if odd_data["name"] == self.api_football.bookmaker
-                    ][0]
-                    if fixture_home_away_ids[fixture["fixture"]['id']][0] == self.team_id_map[player["team_id"]]
-                    else
-                    1 / [
-                        [
-                            float(odd["odd"]) for odd in odd_data["bets"][0]["values"] if odd["value"] == "Away"
-                        ][0]
-                        for odd_data in fixture["bookmakers"]
-                        if odd_data["name"] == self.api_football.bookmaker
-                    ][0]
-                    if fixture_home_away_ids[fixture["fixture"]['id']][1] == self.team_id_map[player["team_id"]]
-                    else
-                    0
-                    for fixture in match_winner_odds
-                ]
+                self.odds_table.get_consensus_probabilities(fixture_id, bet_id).get(side, 0)
+                for fixture_id, side in self._get_team_fixtures().get(self.team_id_map[player["team_id"]], [])
             )
 
         elif prob_source == ProbabilitySource.PREDICTIONS:
@@ -125,39 +147,55 @@ class OptimizationInput:
 
         return prob_sum * self.holdet.get_event_points(self.events['match_winner']['holdet_event_id'])
 
-    def _get_expected_player_scores(self):
-        """Get list of players including expected score."""
+    def _get_expected_player_scores(self) -> PlayerTable:
+        """Get table of players including expected score. The expected score is added as a new column, so the HoldetDk
+        player data is left unchanged."""
 
         player_prob_appear = self.stats.get_prob_appearance()
-        player_scores = self.holdet.player_data
+        goals_per_90 = self.stats.get_stat_players('goals_per_90_overall')
+        assists_per_90 = self.stats.get_stat_players('assists_per_90_overall')
+        cards_per_90 = self.stats.get_stat_players('cards_per_90_overall')
+        appearances_overall = self.stats.get_stat_players('appearances_overall')
+        clean_sheets_overall = self.stats.get_stat_players('clean_sheets_overall')
+        points_goal = {
+            event_key.replace('anytime_goal_', ''): self.holdet.get_event_points(event['holdet_event_id'])
+            for event_key, event in self.events.items() if 'anytime_goal_' in event_key
+        }
+        points_assist = self.holdet.get_event_points(278)
+        points_red = self.holdet.get_event_points(303)
+        points_yellow = self.holdet.get_event_points(313)
+        points_card_avg = (points_red + points_yellow) * 0.5
+        points_defender = self.holdet.get_event_points(280)
+        points_gk = self.holdet.get_event_points(285)
+
+        players = self.holdet.player_data
+        expected_scores = np.zeros(len(players))
+        rows = range(len(players))
         for event_key, event in self.events.items():
             if event_key == "match_winner":
-                for player in player_scores:
+                for i in rows:
+                    player = players[i]
                     player_stats_name = self.name_lookup_holdet_to_stats(player['person_fullname'])
                     # Expected score from team win
                     win_match_exp_score = self._calc_expected_score_match_winner(player) * self.weight_team_win
-                    # Expected score from player goals
+                    # Expected score from player goals: the anytime goal probability from the odds, if the player has
+                    # odds, else the goal rate from the stats (both score the same Holdet event, so only one is used)
                     pos_name = player["position_name_en"].lower()
-                    goals_per_match_exp_score = self.stats.get_stat_players(
-                        'goals_per_90_overall').get(player_stats_name, 0) * self.holdet.get_event_points(
-                        self.events[f'anytime_goal_{pos_name}']['holdet_event_id']
-                    ) * self.weight_player_goals
+                    p_goal = self._get_anytime_goal_probability(
+                        player, self.events[f'anytime_goal_{pos_name}']['bet_id']
+                    )
+                    goals_per_match = p_goal if p_goal is not None else goals_per_90.get(player_stats_name, 0)
+                    goals_per_match_exp_score = goals_per_match * points_goal[pos_name] * self.weight_player_goals
                     # Expected score from player assists
-                    points_assist = self.holdet.get_event_points(278)
-                    assists_per_match_exp_score = self.stats.get_stat_players(
-                        'assists_per_90_overall').get(player_stats_name, 0) * points_assist * self.weight_player_assists
+                    assists_per_match_exp_score = assists_per_90.get(player_stats_name, 0) * points_assist * \
+                        self.weight_player_assists
                     # TODO: add score from team goals
                     # Expected score from player cards
-                    points_red = self.holdet.get_event_points(303)
-                    points_yellow = self.holdet.get_event_points(313)
-                    points_card_avg = (points_red + points_yellow) * 0.5
-                    cards_per_match_exp_score = self.stats.get_stat_players(
-                        'cards_per_90_overall').get(player_stats_name, 0) * points_card_avg * self.weight_player_cards
+                    cards_per_match_exp_score = cards_per_90.get(player_stats_name, 0) * points_card_avg * \
+                        self.weight_player_cards
                     # Expected score from player clean sheets
-                    points_defender = self.holdet.get_event_points(280)
-                    points_gk = self.holdet.get_event_points(285)
-                    appearances = self.stats.get_stat_players('appearances_overall').get(player_stats_name, 0)
-                    clean_sheets = self.stats.get_stat_players('clean_sheets_overall').get(player_stats_name, 0)
+                    appearances = appearances_overall.get(player_stats_name, 0)
+                    clean_sheets = clean_sheets_overall.get(player_stats_name, 0)
                     p_clean_sheet = clean_sheets / appearances if appearances != 0 else 0
                     clean_sheet_exp_score = p_clean_sheet * (
                         points_defender if pos_name == 'defender' else
@@ -166,22 +204,19 @@ class OptimizationInput:
                     ) * self.weight_player_clean_sheets
                     # Combined expected score multiplied by probability of appearance
                     p_appear = player_prob_appear.get(player_stats_name, 0)
-                    player["expected_score"] = p_appear * (
+                    expected_scores[i] = p_appear * (
                             win_match_exp_score +
                             goals_per_match_exp_score +
                             clean_sheet_exp_score +
                             assists_per_match_exp_score +
                             cards_per_match_exp_score
                     )
-            #if 'anytime_goal_' in event_key:
-            #    for player in player_scores:
-            #        player["expected_score"] += self._calc_expected_score_anytime_goal(player)
 
-        return player_scores
+        return players.with_column('expected_score', expected_scores)
 
     def get_current_round_injured_players(self):
         """Get list of player names who are injured for fixtures in the current round."""
-        all_injuries = self.api_football.get_injuries()
+        all_injuries = self.injuries if self.injuries is not None else self.api_football.get_injuries()
         current_round_time_interval = self.holdet.current_round_start_end_time
         round_injuries = [
             injury for injury in all_injuries if
@@ -194,7 +229,7 @@ class OptimizationInput:
         ))
 
     def get_budget(self):
-        value_of_players = sum(player['current_value'] for player in self.players if player['player_id'] in self.existing_player_ids)
+        value_of_players = self.players.column('current_value')[self.players.indices_of(self.existing_player_ids)].sum()
         cash = self.bank_beholdning
         return value_of_players + cash
 
@@ -227,46 +262,66 @@ class OptimizationInput:
 class Optimization:
     """Optimization class."""
 
-    def __init__(self, optimization_input: OptimizationInput):
+    def __init__(
+            self,
+            optimization_input: OptimizationInput,
+            min_prob_appear: float = 0.80,
+            min_spend_portion: float = 0.95,
+            transfer_cost_rate: float = 0.01,
+            max_seconds: float = 30,
+            solver_configs: List[SolverConfig] = None,
+            weight_value_growth: float = 0,
+            prune_dominated: bool = True
+    ):
+        """With solver_configs, run races the solver configurations in parallel processes (see
+        portfolio.solve_portfolio) instead of solving with the default CBC configuration in process. With a
+        weight_value_growth, the expected_value_growth column of the players (see RoundContext) times the weight is
+        added to the objective. With prune_dominated, the presolve drops dominated players before the model is built
+        (see presolve)."""
+
         self.model = mip.Model(solver_name=mip.CBC)
         self.input = optimization_input
+        self.min_prob_appear = min_prob_appear
+        self.min_spend_portion = min_spend_portion
+        self.transfer_cost_rate = transfer_cost_rate
+        self.max_seconds = max_seconds
+        self.solver_configs = solver_configs
+        self.weight_value_growth = weight_value_growth
+        self.prune_dominated = prune_dominated
+        self.players = None
+        self.presolve_stats = None
+        self.portfolio_result = None
 
     # TODO: consider adding existing team to enable adding switching cost
 
     def build_model(self):
 
-        # Add selection variable for each player, and objective coefficient expected score
+        # Add selection variable for each player left by the presolve, and objective coefficient expected score
+        players = self.players = self.presolve()
         x = [
             self.model.add_var(
-                name=str(player["player_id"]),
+                name=str(player_id),
                 var_type=mip.BINARY
-            ) for player in self.input.players
+            ) for player_id in players.column('player_id')
         ]
 
         # Add formation constraints
-        goalkeepers = [
-            x[i] if player["position_name"] == "Mål" else 0 for i, player in enumerate(self.input.players)
-        ]
-        defenders = [
-            x[i] if player["position_name"] == "Forsvar" else 0 for i, player in enumerate(self.input.players)
-        ]
-        midfielders = [
-            x[i] if player["position_name"] == "Midtbane" else 0 for i, player in enumerate(self.input.players)
-        ]
-        attackers = [
-            x[i] if player["position_name"] == "Angreb" else 0 for i, player in enumerate(self.input.players)
-        ]
+        position_name = players.column('position_name')
+        goalkeepers = [x[i] for i in np.flatnonzero(position_name == "Mål")]
+        defenders = [x[i] for i in np.flatnonzero(position_name == "Forsvar")]
+        midfielders = [x[i] for i in np.flatnonzero(position_name == "Midtbane")]
+        attackers = [x[i] for i in np.flatnonzero(position_name == "Angreb")]
         self.model.add_constr(
             name="Exactly 11 players",
-            lin_expr=sum(x) == 11
+            lin_expr=mip.xsum(x) == TEAM_SIZE
         )
         self.model.add_constr(
             name="Formation exactly 1 goalkeeper",
-            lin_expr=mip.xsum(goalkeepers) == 1
+            lin_expr=mip.xsum(goalkeepers) == MAX_PLAYERS_PER_POSITION["Mål"]
         )
         self.model.add_constr(
             name="Formation max 5 defenders",
-            lin_expr=mip.xsum(defenders) <= 5
+            lin_expr=mip.xsum(defenders) <= MAX_PLAYERS_PER_POSITION["Forsvar"]
         )
         self.model.add_constr(
             name="Formation min 3 defenders",
@@ -274,7 +329,7 @@ class Optimization:
         )
         self.model.add_constr(
             name="Formation max 5 midfielders",
-            lin_expr=mip.xsum(midfielders) <= 5
+            lin_expr=mip.xsum(midfielders) <= MAX_PLAYERS_PER_POSITION["Midtbane"]
         )
         self.model.add_constr(
             name="Formation min 3 midfielders",
@@ -282,7 +337,7 @@ class Optimization:
         )
         self.model.add_constr(
             name="Formation max 3 attackers",
-            lin_expr=mip.xsum(attackers) <= 3
+            lin_expr=mip.xsum(attackers) <= MAX_PLAYERS_PER_POSITION["Angreb"]
         )
         self.model.add_constr(
             name="Formation min 1 attacker",
@@ -290,54 +345,22 @@ class Optimization:
         )
 
         # Add team constraints
-        teams = list(set([player["team_name"] for player in self.input.players]))
+        team_name = players.column('team_name')
+        teams = list(set(team_name.tolist()))
         players_by_team = [
-            [
-                x[i] if player["team_name"] == team else 0 for i, player in enumerate(self.input.players)
-            ] for team in teams
+            [x[i] for i in np.flatnonzero(team_name == team)] for team in teams
         ]
         for team in players_by_team:
-            self.model.add_constr(
-                name="Max 4 players from same team",
-                lin_expr=mip.xsum(team) <= 4
-            )
-
-        # Add constraint to avoid injured or eliminated/non-active players
-        injured_players = self.input.get_current_round_injured_players()
-        injured_players_holdet_names = [
-            player_holdet['person_fullname']
-            for player_holdet in self.input.players
-            for player_api in injured_players
-            if fuzz.ratio(player_holdet['person_shortname'], player_api) > 80
-        ]
-        for i, player in enumerate(self.input.players):
-            if player['is_eliminated'] or not player['is_active']:
+            if len(team) > MAX_PLAYERS_PER_TEAM:
                 self.model.add_constr(
-                    name=f"Avoid buying non-active or eliminated player {player['person_fullname']}.",
-                    lin_expr=x[i] == 0
-                )
-            elif player['person_shortname'] in injured_players_holdet_names:
-                self.model.add_constr(
-                    name=f"Avoid buying injured player {player['person_fullname']}.",
-                    lin_expr=x[i] == 0
-                )
-        # Exclude players below a given qualifier appearance level (to avoid solver choosing strategy of half team
-        # with no appearance).
-        min_prob_appear = 0.80
-        player_prob_appear = self.input.stats.get_prob_appearance()
-        for i, player in enumerate(self.input.players):
-            player_stats_name = self.input.name_lookup_holdet_to_stats(player['person_fullname'])
-            p_appear = player_prob_appear.get(player_stats_name, 0)
-            if p_appear < min_prob_appear:
-                self.model.add_constr(
-                    name=f"Avoid buying player with low probability of appearance {player['person_fullname']}.",
-                    lin_expr=x[i] == 0
+                    name="Max 4 players from same team",
+                    lin_expr=mip.xsum(team) <= MAX_PLAYERS_PER_TEAM
                 )
 
         # Add budget constraint
         budget = self.input.get_budget()
-        min_spend_portion = 0.95
-        team_value = mip.xsum(x[i] * player['current_value'] for i, player in enumerate(self.input.players))
+        min_spend_portion = self.min_spend_portion
+        team_value = mip.xsum(x[i] * value for i, value in enumerate(players.column('current_value')))
         self.model.add_constr(
             name="Budget constraint",
             lin_expr=team_value <= budget
@@ -347,73 +370,259 @@ class Optimization:
             lin_expr=team_value >= budget * min_spend_portion
         )
 
-        # Define objective terms
-        transfer_cost_rate = 0.01
-        transfer_costs_shift_in = [
-            -player['current_value'] * transfer_cost_rate   # Transfer costs to shift in a player
-            if player['player_id'] not in self.input.existing_player_ids
-            else 0
-            for i, player in enumerate(self.input.players)
-        ]
         # Add objective
         # Maximize sum of expected score of chosen players.
-        # Add transfer costs.
+        # Add transfer costs and weighted expected value growth.
         self.model.objective = mip.maximize(
-            mip.xsum(
-                x[i] * (player["expected_score"] + transfer_costs_shift_in[i])
-                for i, player in enumerate(self.input.players)
-            )
+            mip.xsum(x[i] * objective_coef for i, objective_coef in enumerate(self._get_objective_coefs(players)))
         )
 
+    def _get_objective_coefs(self, players: PlayerTable) -> np.ndarray:
+        """Returns the objective coefficient of each player: the expected score less the transfer costs of buying the
+        player, plus the weighted expected value growth."""
+
+        # Transfer costs to shift in a player
+        transfer_costs_shift_in = -players.column('current_value') * self.transfer_cost_rate
+        transfer_costs_shift_in[players.indices_of(self.input.existing_player_ids)] = 0
+        objective_coefs = players.column('expected_score') + transfer_costs_shift_in
+        # Expected value growth of the players in the next round
+        if self.weight_value_growth != 0:
+            if 'expected_value_growth' not in players.columns:
+                raise Exception("The players have no expected_value_growth to weight, see RoundContext.")
+            objective_coefs = objective_coefs + players.column('expected_value_growth') * self.weight_value_growth
+        return objective_coefs
+
+    def presolve(self) -> PlayerTable:
+        """Returns the players that can be in an optimal team, and sets presolve_stats. Players that may not be bought
+        (non-active, eliminated, injured or with a probability of appearance below min_prob_appear) are dropped, and
+        with prune_dominated so are dominated players (see _get_dominated)."""
+
+        start = time.perf_counter()
+        players = self.input.players
+        # Non-active or eliminated players
+        inactive = players.column('is_eliminated').astype(bool) | ~players.column('is_active').astype(bool)
+        # Injured players
+        injured_players = self.input.get_current_round_injured_players()
+        injured_players_holdet_names = [
+            player_holdet['person_fullname']
+            for player_holdet in players
+            for player_api in injured_players
+            if fuzz.ratio(player_holdet['person_shortname'], player_api) > 80
+        ]
+        injured = ~inactive & np.isin(players.column('person_shortname'), injured_players_holdet_names)
+        # Players below a given qualifier appearance level (to avoid solver choosing strategy of half team with no
+        # appearance).
+        player_prob_appear = self.input.stats.get_prob_appearance()
+        p_appear = np.array([
+            player_prob_appear.get(self.input.name_lookup_holdet_to_stats(player_fullname), 0)
+            for player_fullname in players.column('person_fullname')
+        ])
+        low_appearance = ~inactive & ~injured & (p_appear < self.min_prob_appear)
+
+        candidates = np.flatnonzero(~(inactive | injured | low_appearance))
+        dominated = np.zeros(len(candidates), dtype=bool)
+        if self.prune_dominated:
+            dominated = self._get_dominated(players.take(candidates))
+        kept = candidates[~dominated]
+        self.presolve_stats = {
+            "players": len(players),
+            "inactive": int(inactive.sum()),
+            "injured": int(injured.sum()),
+            "low_appearance": int(low_appearance.sum()),
+            "dominated": int(dominated.sum()),
+            "kept": len(kept),
+            "seconds": time.perf_counter() - start,
+        }
+        logging.info(f"Presolve kept {len(kept)} of {len(players)} players: {self.presolve_stats}.")
+        return players.take(kept)
+
+    def _get_dominated(self, players: PlayerTable) -> np.ndarray:
+        """Returns a mask of the players that are dominated by enough other players to never be needed in an optimal
+        team. A player dominates another of the same position if it is no more expensive (equally expensive with a
+        minimum spend, so swapping keeps the spend), has at least the objective coefficient and, if known, the
+        expected value growth. Players are decided in an order where dominators come first, and a player is dominated
+        if its kept dominators, less those of the teams that could be full in an optimal team, are at least the most
+        players of its position in a team. Then any optimal team with the player has a dominator to swap it for, so
+        the optimum is unchanged."""
+
+        coefs = self._get_objective_coefs(players)
+        values = players.column('current_value').astype(float)
+        growth = players.column('expected_value_growth') if 'expected_value_growth' in players.columns else \
+            np.zeros(len(players))
+        team_codes = np.unique(players.column('team_name').astype(str), return_inverse=True)[1]
+        position_name = players.column('position_name')
+        # Highest objective coefficient first, then lowest value, then highest growth.
+        order = np.lexsort((-growth, values, -coefs))
+        # Teams other than the player's own that could be full in a team with the player.
+        full_teams = (TEAM_SIZE - 1) // MAX_PLAYERS_PER_TEAM
+        dominated = np.zeros(len(players), dtype=bool)
+        for position, max_players in MAX_PLAYERS_PER_POSITION.items():
+            rows = order[position_name[order] == position]
+            if self.min_spend_portion > 0:
+                no_more_expensive = values[rows][:, None] == values[rows][None, :]
+            else:
+                no_more_expensive = values[rows][:, None] <= values[rows][None, :]
+            # dominates[a, b]: player rows[a] dominates player rows[b], only if a comes first.
+            dominates = np.triu(
+                no_more_expensive
+                & (coefs[rows][:, None] >= coefs[rows][None, :])
+                & (growth[rows][:, None] >= growth[rows][None, :]),
+                k=1
+            )
+            kept = np.zeros(len(rows), dtype=bool)
+            for b in range(len(rows)):
+                dominators = rows[np.flatnonzero(dominates[:b, b] & kept[:b])]
+                if len(dominators) >= max_players:
+                    team_counts = np.bincount(team_codes[dominators], minlength=team_codes.max() + 1)
+                    team_counts[team_codes[rows[b]]] = 0
+                    if len(dominators) - np.sort(team_counts)[::-1][:full_teams].sum() >= max_players:
+                        dominated[rows[b]] = True
+                        continue
+                kept[b] = True
+        return dominated
+
     def run(self):
         # optimize and return results
+        if self.solver_configs:
+            self.portfolio_result = solve_portfolio(self.model, self.solver_configs, max_seconds=self.max_seconds)
+            return
         self.model.verbose = False
-        self.model.optimize(max_seconds=30)
+        with _cbc_lock:
+            self.model.optimize(max_seconds=self.max_seconds)
 
     def get_result(self) -> dict:
         """Returns optimum, i.e. selected players that optimizes expected score."""
-        selected_player_ids = [int(var.name) for var in self.model.vars._VarList__vars if var.x == 1]
+        if self.portfolio_result is not None:
+            selected_player_ids = [
+                int(var.name) for var, value in zip(self.model.vars, self.portfolio_result['values']) if value >= 0.5
+            ]
+            objective_value = self.portfolio_result['objective_value']
+        else:
+            selected_player_ids = [int(var.name) for var in self.model.vars._VarList__vars if var.x == 1]
+            objective_value = self.model.objective_value
+        return {**self._get_team(selected_player_ids), "expected_score": objective_value}
+
+    def _get_team(self, selected_player_ids: List[int]) -> dict:
+        """Returns the players, formation and total value of a team."""
         players = [
                 {
-                    "person_fullname": next(
-                        (
-                            player["person_fullname"]
-                            for player in self.input.players if player['player_id'] == player_id
-                        ),
-                        None
-                    ),
-                    "position_name_en": next(
-                        (
-                            player["position_name_en"]
-                            for player in self.input.players if player['player_id'] == player_id
-                        ),
-                        None
-                    ),
-                    "team_name": next(
-                        (
-                            player["team_name"]
-                            for player in self.input.players if player['player_id'] == player_id
-                        ),
-                        None
-                    ),
+                    "person_fullname": player["person_fullname"],
+                    "position_name_en": player["position_name_en"],
+                    "team_name": player["team_name"],
                 }
-                for player_id in selected_player_ids
+                for player in map(self.input.players.row_by_id, selected_player_ids)
             ]
         formation = (
             f"{len([p for p in players if p['position_name_en'] == 'Defense'])}"
             f"{len([p for p in players if p['position_name_en'] == 'Midfielder'])}"
             f"{len([p for p in players if p['position_name_en'] == 'Striker'])}"
         )
-        players_total_value = sum(
-            player['current_value'] for player in self.input.players if player['player_id'] in selected_player_ids
-        )
+        players_total_value = self.input.players.column('current_value')[
+            self.input.players.indices_of(selected_player_ids)
+        ].sum()
         return {
             "optimal_team": players,
+            "selected_player_ids": selected_player_ids,
             "formation": formation,
-            "expected_score": self.model.objective_value,
             "players_total_value": players_total_value
         }
 
+    def _solve_in_process(self, start: List[int] = None) -> List[int] | None:
+        """Solve the model as is, warm-started from the players of start if given. Returns the selected players, or
+        None if no solution was found."""
+
+        self.model.verbose = False
+        if start:
+            self.model.start = [(self.model.var_by_name(str(player_id)), 1.0) for player_id in start]
+        with _cbc_lock:
+            self.model.optimize(max_seconds=self.max_seconds)
+        if self.model.num_solutions == 0:
+            return None
+        return [int(var.name) for var in self.model.vars if var.x >= 0.5]
+
+    def get_frontier(self, criterion: str = 'spend', n_points: int = 10) -> List[dict]:
+        """Returns the Pareto frontier of the expected score versus the spend (players total value) or versus the
+        expected value growth of the team, as the optimal team at each breakpoint, ordered from the cheapest (or
+        highest growth) team to the optimum, which is flagged as optimum.
+
+        Computed by an epsilon-constraint sweep on the built model: a constraint bounds the criterion, and the model is
+        solved for n_points bounds between the two ends of the frontier, relaxing the bound at every point so the team
+        of the previous point is feasible and warm-starts the solve. The model is reused, so it is built only once.
+        For the spend, the minimum spend constraint is relaxed during the whole sweep, so teams keeping cash are on the
+        frontier. The optimum is then the relaxed optimum, which can spend less and score higher than the team of run.
+        Such points are flagged as min_spend_relaxed. The points are solved in process, without solver_configs. The
+        model is restored afterwards."""
+
+        players = self.players
+        if criterion == 'spend':
+            coefs, sense = players.column('current_value'), 1
+        elif criterion == 'value_growth':
+            if 'expected_value_growth' not in players.columns:
+                raise Exception("The players have no expected_value_growth for the frontier, see RoundContext.")
+            coefs, sense = players.column('expected_value_growth'), -1
+        else:
+            raise Exception(f"Unknown frontier criterion {criterion}, use 'spend' or 'value_growth'.")
+        criterion_expr = mip.xsum(var * coef for var, coef in zip(self.model.vars, coefs))
+        objective, objective_sense = self.model.objective, self.model.sense
+        min_spend = self.model.constr_by_name("Minimum spend constraint")
+        min_spend_rhs = min_spend.rhs
+
+        def criterion_value(selected_player_ids):
+            return float(coefs[players.indices_of(selected_player_ids)].sum())
+
+        min_spend_relaxed = criterion == 'spend'
+        points, frontier = [], None
+        try:
+            if min_spend_relaxed:
+                min_spend.rhs = 0
+            # The ends of the frontier: the best team by the criterion alone, and the optimum.
+            self.model.objective = mip.minimize(sense * criterion_expr)
+            first = self._solve_in_process()
+            self.model.objective = objective
+            self.model.sense = objective_sense
+            last = self._solve_in_process(start=first)
+            if first is None or last is None:
+                raise Exception("No feasible team found.")
+            last_score = self.model.objective_value
+            frontier = self.model.add_constr(
+                sense * criterion_expr <= sense * criterion_value(first), name="Frontier constraint"
+            )
+            bounds = np.linspace(criterion_value(first), criterion_value(last), max(n_points, 2))
+            selected_player_ids = first
+            for bound in bounds[:-1]:
+                start = time.perf_counter()
+                frontier.rhs = sense * bound
+                solution = self._solve_in_process(start=selected_player_ids)
+                if solution is None:
+                    continue
+                selected_player_ids = solution
+                points.append({
+                    **self._get_team(selected_player_ids),
+                    "expected_score": self.model.objective_value,
+                    criterion: criterion_value(selected_player_ids),
+                    "bound": bound,
+                    "seconds": time.perf_counter() - start,
+                    "optimum": False,
+                    "min_spend_relaxed": min_spend_relaxed,
+                })
+            points.append({
+                **self._get_team(last), "expected_score": last_score, criterion: criterion_value(last),
+                "bound": bounds[-1], "seconds": 0, "optimum": True, "min_spend_relaxed": min_spend_relaxed,
+            })
+        finally:
+            if frontier is not None:
+                self.model.remove(frontier)
+            min_spend.rhs = min_spend_rhs
+            self.model.objective = objective
+            self.model.sense = objective_sense
+
+        # Keep the breakpoints: points improving the expected score over the previous point.
+        breakpoints = []
+        for point in points:
+            if not breakpoints or point["expected_score"] > breakpoints[-1]["expected_score"] + 1e-6:
+                breakpoints.append(point)
+        return breakpoints
+
 
 # class Visualization:
 #     """Visualize output."""
@@ -0,0 +1,174 @@
+import os
+import time
+import queue
+import logging
+import multiprocessing
+import mip
+from typing import List, Dict
+
+
+class SolverConfig:
+    """A solver configuration of a portfolio: solver, random seed, search emphasis, cut generation level (-1 automatic,
+    0 off to 3 aggressive), preprocessing (-1 automatic, 0 off, 1 on) and threads."""
+
+    def __init__(
+            self,
+            name: str,
+            solver_name: str = mip.CBC,
+            seed: int = 0,
+            emphasis: mip.SearchEmphasis = mip.SearchEmphasis.DEFAULT,
+            cuts: int = -1,
+            preprocess: int = -1,
+            threads: int = 1
+    ):
+        self.name = name
+        self.solver_name = solver_name
+        self.seed = seed
+        self.emphasis = emphasis
+        self.cuts = cuts
+        self.preprocess = preprocess
+        self.threads = threads
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+DEFAULT_PORTFOLIO = [
+    SolverConfig('default'),
+    SolverConfig('feasibility', emphasis=mip.SearchEmphasis.FEASIBILITY, cuts=0, seed=1),
+    SolverConfig('optimality', emphasis=mip.SearchEmphasis.OPTIMALITY, cuts=2, seed=2),
+    SolverConfig('no-preprocess', preprocess=0, seed=3),
+]
+"""Configurations raced by default, the first os.cpu_count() of them are used."""
+
+
+def get_model_data(model: mip.Model) -> dict:
+    """Return the variables, constraints and objective of a model as plain lists, so it can be sent to and rebuilt in
+    another process. (Writing the model to an MPS file does not keep the objective sense and variable types.)"""
+
+    var_index = {var.idx: i for i, var in enumerate(model.vars)}
+    return {
+        'sense': model.sense,
+        'vars': [(var.name, var.var_type, var.lb, var.ub) for var in model.vars],
+        'objective': [(var_index[var.idx], coef) for var, coef in model.objective.expr.items()],
+        'objective_const': model.objective.const,
+        'constrs': [
+            ([(var_index[var.idx], coef) for var, coef in constr.expr.expr.items()], constr.expr.sense, constr.rhs)
+            for constr in model.constrs
+        ],
+    }
+
+
+def build_model(model_data: dict, config: SolverConfig) -> mip.Model:
+    """Build a model from get_model_data with the settings of a solver configuration."""
+
+    model = mip.Model(sense=model_data['sense'], solver_name=config.solver_name)
+    model.verbose = False
+    model.seed = config.seed
+    model.emphasis = config.emphasis
+    model.cuts = config.cuts
+    model.preprocess = config.preprocess
+    model.threads = config.threads
+    x = [model.add_var(name=name, var_type=var_type, lb=lb, ub=ub) for name, var_type, lb, ub in model_data['vars']]
+    for terms, sense, rhs in model_data['constrs']:
+        lin_expr = mip.xsum(coef * x[i] for i, coef in terms)
+        if sense == mip.LESS_OR_EQUAL:
+            model.add_constr(lin_expr <= rhs)
+        elif sense == mip.GREATER_OR_EQUAL:
+            model.add_constr(lin_expr >= rhs)
+        else:
+            model.add_constr(lin_expr == rhs)
+    model.objective = mip.xsum(coef * x[i] for i, coef in model_data['objective']) + model_data['objective_const']
+    return model
+
+
+def solve(model_data: dict, config: SolverConfig, max_seconds: float) -> dict:
+    """Solve a model with one solver configuration. Returns the status, objective value and bound, the variable values
+    (None without a solution) and the solve time."""
+
+    start = time.perf_counter()
+    model = build_model(model_data, config)
+    status = model.optimize(max_seconds=max_seconds)
+    has_solution = status in (mip.OptimizationStatus.OPTIMAL, mip.OptimizationStatus.FEASIBLE)
+    return {
+        'config': config.name,
+        'status': status.name,
+        'objective_value': model.objective_value if has_solution else None,
+        'objective_bound': model.objective_bound,
+        'values': [var.x for var in model.vars] if has_solution else None,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def _solve_worker(model_data: dict, config: SolverConfig, max_seconds: float, results: multiprocessing.Queue):
+    try:
+        results.put(solve(model_data, config, max_seconds))
+    except Exception as e:
+        results.put({'config': config.name, 'status': 'ERROR', 'error': repr(e), 'objective_value': None})
+
+
+def solve_portfolio(
+        model: mip.Model,
+        configs: List[SolverConfig] = None,
+        max_seconds: float = 30,
+        start_method: str = 'spawn'
+) -> Dict:
+    """Race solver configurations on a model, each in its own process. The first configuration that proves optimality
+    wins and the others are cancelled. If none does within max_seconds, the best incumbent found by any configuration
+    is returned. Returns the result of solve for the winning configuration, with the results of all configurations
+    under 'results' (cancelled configurations have status 'CANCELLED').
+
+    The processes are spawned by default, as forking a threaded web server process can deadlock on locks held by
+    other threads."""
+
+    configs = configs or DEFAULT_PORTFOLIO[:os.cpu_count() or 1]
+    model_data = get_model_data(model)
+    maximize = model_data['sense'] == mip.MAXIMIZE
+    mp_context = multiprocessing.get_context(start_method)
+    results_queue = mp_context.Queue()
+    processes = {
+        config.name: mp_context.Process(
+            target=_solve_worker, args=(model_data, config, max_seconds, results_queue), daemon=True
+        )
+        for config in configs
+    }
+    for process in processes.values():
+        process.start()
+
+    # Allow for process start (imports, with spawn) and model build on top of the solver time limit.
+    deadline = time.monotonic() + max_seconds + 10
+    results = {}
+    try:
+        while len(results) < len(processes):
+            try:
+                result = results_queue.get(timeout=min(max(deadline - time.monotonic(), 0), 1))
+            except queue.Empty:
+                # Stop at the deadline, or if every process has exited (e.g. crashed) without a result.
+                if time.monotonic() >= deadline or not any(process.is_alive() for process in processes.values()):
+                    break
+                continue
+            results[result['config']] = result
+            if result['status'] == mip.OptimizationStatus.OPTIMAL.name:
+                break
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            process.join()
+
+    incumbents = [result for result in results.values() if result['objective_value'] is not None]
+    if len(incumbents) == 0:
+        raise Exception(f"No solver configuration found a solution: {results}")
+    optimal = [result for result in incumbents if result['status'] == mip.OptimizationStatus.OPTIMAL.name]
+    winner = optimal[0] if optimal else (max if maximize else min)(
+        incumbents, key=lambda result: result['objective_value']
+    )
+    logging.info(f"Solver portfolio won by {winner['config']} ({winner['status']}) in {winner['seconds']:.2f} s.")
+    return dict(winner, results=[
+        {key: value for key, value in result.items() if key != 'values'}
+        for result in (
+            results.get(config.name, {'config': config.name, 'status': 'CANCELLED', 'objective_value': None})
+            for config in configs
+        )
+    ])
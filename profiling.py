@@ -0,0 +1,159 @@
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import logging
+import tempfile
+import datetime as dt
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'holdet-optimizer-profiles'))
+"""Directory the request profiles are saved to."""
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+"""Portion of optimization requests that are profiled, e.g. 0.01."""
+
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+"""Requests with this value in the PROFILE_HEADER header are profiled. Profiling on demand is disabled if not set."""
+
+PROFILE_HEADER = 'X-Profile-Token'
+
+
+class CallTreeProfiler:
+    """Deterministic profiler of the current thread, like cProfile, but keeping the full call stacks: the time of each
+    call is added to a call tree node per unique stack, so the profile can be shown as a flamegraph. Calls of C
+    functions, e.g. the CBC solve, are included."""
+
+    def __init__(self):
+        self.frames = []
+        self._frame_index = {}
+        self._root = [0.0, {}]  # Node: [total seconds, children by frame index]
+        self._stack = []
+        self.start_time = None
+        self.seconds = None
+
+    def _get_frame_index(self, key: tuple) -> int:
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append(key)
+        return index
+
+    def _profile(self, frame, event, arg):
+        now = time.perf_counter()
+        if event == 'call' or event == 'c_call':
+            if event == 'call':
+                code = frame.f_code
+                key = (getattr(code, 'co_qualname', code.co_name), code.co_filename, code.co_firstlineno)
+            else:
+                key = (f"{getattr(arg, '__module__', None) or ''}.{getattr(arg, '__qualname__', repr(arg))}", '', 0)
+            children = self._stack[-1][0][1]
+            index = self._get_frame_index(key)
+            node = children.get(index)
+            if node is None:
+                node = children[index] = [0.0, {}]
+            self._stack.append((node, now))
+        elif len(self._stack) > 1:
+            # return, c_return or c_exception. Returns from frames entered before start are ignored.
+            node, start = self._stack.pop()
+            node[0] += now - start
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self._stack = [(self._root, self.start_time)]
+        sys.setprofile(self._profile)
+
+    def stop(self):
+        sys.setprofile(None)
+        self.seconds = time.perf_counter() - self.start_time
+        self._root[0] = self.seconds
+
+    def to_speedscope(self, name: str) -> dict:
+        """Return the profile in the speedscope file format (https://www.speedscope.app), as a sampled profile with a
+        sample per call stack weighted by its self time."""
+
+        samples, weights = [], []
+
+        def add_samples(node, stack):
+            total, children = node
+            self_seconds = total - sum(child[0] for child in children.values())
+            if self_seconds > 0 and stack:
+                samples.append(stack)
+                weights.append(self_seconds)
+            for index, child in children.items():
+                add_samples(child, stack + [index])
+
+        add_samples(self._root, [])
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'holdet-optimizer',
+            'shared': {'frames': [
+                {'name': frame_name, 'file': file, 'line': line} for frame_name, file, line in self.frames
+            ]},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+
+
+class RequestProfiler:
+    """Context manager profiling a block if the request is eligible and has the PROFILE_HEADER header with
+    PROFILE_TOKEN, or is picked by sampling at PROFILE_SAMPLE_RATE. The profile is saved to PROFILE_DIR as a speedscope
+    file. If inputs are set (they may be set inside the block, once known), they are saved with the metadata (e.g. the
+    round data version) as a JSON line in an inputs file, which is a valid squads file of batch.py, so a slow case can
+    be reproduced offline."""
+
+    def __init__(
+            self,
+            headers,
+            inputs: dict = None,
+            metadata: dict = None,
+            name: str = 'optimize',
+            eligible: bool = True
+    ):
+        self.inputs = inputs
+        self.metadata = metadata or {}
+        self.name = name
+        self.enabled = eligible and (
+            (PROFILE_TOKEN is not None and hmac.compare_digest(
+                headers.get(PROFILE_HEADER, '').encode(), PROFILE_TOKEN.encode()
+            ))
+            or random.random() < PROFILE_SAMPLE_RATE
+        )
+        self.profiler = CallTreeProfiler() if self.enabled else None
+        self.path = None
+
+    def __enter__(self):
+        if self.enabled:
+            self.profiler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.enabled:
+            self.profiler.stop()
+            self.path = self.save(error=repr(exc_value) if exc_value is not None else None)
+            logging.info(f'Request profiled in {self.profiler.seconds:.2f} s, saved to {self.path}.')
+
+    def save(self, error: str = None) -> str:
+        """Save the profile and the inputs if set, returning the path of the profile."""
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base_path = os.path.join(
+            PROFILE_DIR, f"{dt.datetime.now(dt.timezone.utc):%Y%m%dT%H%M%S%f}-{os.getpid()}-{self.name}"
+        )
+        with open(f"{base_path}.speedscope.json", 'w') as f:
+            json.dump(self.profiler.to_speedscope(self.name), f)
+        if self.inputs is not None:
+            with open(f"{base_path}.inputs.jsonl", 'w') as f:
+                f.write(json.dumps({
+                    **self.inputs, **self.metadata, 'profile_seconds': self.profiler.seconds, 'profile_error': error
+                }, default=str) + '\n')
+        return f"{base_path}.speedscope.json"
@@ -0,0 +1,63 @@
+import numpy as np
+from typing import List, Dict
+
+from data import PlayerTable, name_key
+
+SEARCH_RESULT_COLUMNS = ['player_id', 'person_fullname', 'team_name', 'position_name_en', 'current_value']
+"""Player columns returned by a search."""
+
+
+class PlayerSearchIndex:
+    """Prefix index over the tokens of the players' full name, team name and position. A query matches the players
+    that have, for every query token, a token starting with it. E.g. "chr dan mid" matches the midfielders of Danmark
+    named Christian or Christoffer. Results are ordered by full name."""
+
+    def __init__(self, players: PlayerTable):
+        self.players = players
+        prefixes = {}
+        for i, (fullname, team_name, position_name, position_name_en) in enumerate(zip(
+                players.column('person_fullname').tolist(),
+                players.column('team_name').tolist(),
+                players.column('position_name').tolist(),
+                players.column('position_name_en').tolist()
+        )):
+            text = f"{fullname} {team_name} {position_name} {position_name_en}"
+            # A set, so a prefix shared by several tokens (e.g. "mid" of Midtbane and Midfielder) lists the row once.
+            tokens = set(name_key(text, keep_digits=True).split())
+            row_prefixes = {token[:n] for token in tokens for n in range(1, len(token) + 1)}
+            for prefix in row_prefixes:
+                prefixes.setdefault(prefix, []).append(i)
+        self._prefixes = {prefix: np.array(sorted(rows), dtype=np.int64) for prefix, rows in prefixes.items()}
+        self._name_rank = np.empty(len(players), dtype=np.int64)
+        self._name_rank[np.argsort(np.array([name_key(str(name)) for name in players.column('person_fullname')]))] = \
+            np.arange(len(players))
+        self._position_name_en = np.array([str(position).lower() for position in players.column('position_name_en')])
+
+    def search(self, query: str = '', position: str = None, player_ids: List[int] = None) -> np.ndarray:
+        """Return the rows of the players matching the query, position (English position name) and player IDs, ordered
+        by full name."""
+
+        rows = np.arange(len(self.players)) if player_ids is None else np.unique(self.players.indices_of(player_ids))
+        for token in name_key(query, keep_digits=True).split():
+            rows = np.intersect1d(rows, self._prefixes.get(token, np.empty(0, dtype=np.int64)), assume_unique=True)
+        if position:
+            rows = rows[self._position_name_en[rows] == position.lower()]
+        return rows[np.argsort(self._name_rank[rows])]
+
+    def search_page(self, query: str = '', position: str = None, player_ids: List[int] = None, page: int = 1,
+                    per_page: int = 25) -> Dict:
+        """Return a page of players matching a search, together with the total number of matches."""
+
+        rows = self.search(query, position, player_ids)
+        page_rows = rows[(page - 1) * per_page:page * per_page]
+        columns = {
+            # Missing values (NaN) are returned as None, since NaN is not valid JSON.
+            column: [None if value != value else value for value in self.players.column(column)[page_rows].tolist()]
+            for column in SEARCH_RESULT_COLUMNS
+        }
+        return {
+            'total': len(rows),
+            'page': page,
+            'per_page': per_page,
+            'players': [dict(zip(columns.keys(), values)) for values in zip(*columns.values())],
+        }
@@ -0,0 +1,62 @@
+import os
+import json
+import hashlib
+import tempfile
+from cachelib import FileSystemCache
+from typing import List
+
+SOLVE_CACHE_DIR = os.environ.get(
+    'SOLVE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'holdet-optimizer-solve-cache')
+)
+"""Directory of the solve result caches. The worker processes of an instance share the files."""
+
+
+def solve_cache_key(
+        data_version: str,
+        existing_player_ids: List[int],
+        bank_beholdning: float,
+        weights: dict,
+        solver_settings: dict
+) -> str:
+    """Return a hash of everything a solve result depends on: the round data version, the existing team (in any order),
+    the cash holding, the optimization factor weights and the solver settings."""
+
+    return hashlib.sha256(json.dumps({
+        'data_version': data_version,
+        'existing_player_ids': sorted(int(player_id) for player_id in existing_player_ids),
+        'bank_beholdning': float(bank_beholdning),
+        'weights': {key: float(value) for key, value in weights.items()},
+        'solver_settings': solver_settings,
+    }, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SolveCache:
+    """Solve results of a game by solve_cache_key, in files shared by the worker processes of an instance. Holds at most
+    max_entries results, the oldest are evicted first. All results are removed when the round data version changes."""
+
+    def __init__(self, name: str, directory: str = SOLVE_CACHE_DIR, max_entries: int = 500):
+        self._cache = FileSystemCache(os.path.join(directory, name), threshold=max_entries, default_timeout=0)
+        # Kept outside the cache directory, so it is not evicted with the results.
+        self._version_path = os.path.join(directory, f"{name}.data_version")
+
+    def get(self, key: str):
+        return self._cache.get(key)
+
+    def set(self, key: str, result):
+        self._cache.set(key, result)
+
+    def set_data_version(self, data_version: str):
+        """Remove all results if they may be of another round data version than data_version. Called by every process
+        when its round data changes; the first process to see a new version clears the results."""
+
+        try:
+            with open(self._version_path) as f:
+                if f.read() == data_version:
+                    return
+        except FileNotFoundError:
+            pass
+        self._cache.clear()
+        temp_path = f"{self._version_path}.{os.getpid()}"
+        with open(temp_path, 'w') as f:
+            f.write(data_version)
+        os.replace(temp_path, self._version_path)
@@ -1,7 +1,120 @@
 'use strict';
 
+// Player picker of the team form. Searches the players server side (see player_search in main.py) and keeps the IDs of
+// the selected players in the hidden player_ids input.
 window.addEventListener('load', function () {
 
-  console.log("Hello World!");
+  const picker = document.getElementById('player-picker');
+  const playerIdsInput = document.getElementById('player_ids');
+  if (!picker || !playerIdsInput) {
+    return;
+  }
+  const searchUrl = picker.dataset.searchUrl;
+  const queryInput = document.getElementById('player-picker-query');
+  const results = document.getElementById('player-picker-results');
+  const moreButton = document.getElementById('player-picker-more');
+  const selectedList = document.getElementById('player-picker-selected');
+  const count = document.getElementById('player-picker-count');
+  const maxPlayers = 11;
+  const perPage = 25;
 
-});
\ No newline at end of file
+  const selected = new Map();  // player_id -> player
+  let page = 1;
+  let debounceTimer = null;
+  let latestRequest = 0;
+
+  function label(player) {
+    return `${player.person_fullname} (${player.team_name}, ${player.position_name_en})`;
+  }
+
+  function fetchPlayers(params) {
+    return fetch(`${searchUrl}?${new URLSearchParams(params)}`).then(function (response) {
+      if (!response.ok) {
+        throw new Error(`Player search failed: ${response.status}`);
+      }
+      return response.json();
+    });
+  }
+
+  function renderSelected() {
+    selectedList.replaceChildren();
+    selected.forEach(function (player, playerId) {
+      const item = document.createElement('li');
+      item.className = 'list-group-item d-flex justify-content-between align-items-center';
+      item.textContent = label(player);
+      const removeButton = document.createElement('button');
+      removeButton.type = 'button';
+      removeButton.className = 'btn btn-sm btn-outline-danger';
+      removeButton.textContent = 'Remove';
+      removeButton.addEventListener('click', function () {
+        selected.delete(playerId);
+        renderSelected();
+      });
+      item.appendChild(removeButton);
+      selectedList.appendChild(item);
+    });
+    playerIdsInput.value = Array.from(selected.keys()).join(',');
+    count.textContent = selected.size;
+  }
+
+  function renderResults(data, append) {
+    if (!append) {
+      results.replaceChildren();
+    }
+    data.players.forEach(function (player) {
+      const item = document.createElement('button');
+      item.type = 'button';
+      item.className = 'list-group-item list-group-item-action';
+      item.textContent = label(player);
+      item.addEventListener('click', function () {
+        if (selected.size < maxPlayers && !selected.has(player.player_id)) {
+          selected.set(player.player_id, player);
+          renderSelected();
+        }
+      });
+      results.appendChild(item);
+    });
+    moreButton.hidden = data.page * data.per_page >= data.total;
+  }
+
+  function search(append) {
+    const query = queryInput.value.trim();
+    if (!query) {
+      results.replaceChildren();
+      moreButton.hidden = true;
+      return;
+    }
+    const request = ++latestRequest;
+    fetchPlayers({q: query, page: page, per_page: perPage}).then(function (data) {
+      // Ignore responses to queries that have since been replaced.
+      if (request === latestRequest) {
+        renderResults(data, append);
+      }
+    }).catch(console.error);
+  }
+
+  queryInput.addEventListener('input', function () {
+    clearTimeout(debounceTimer);
+    debounceTimer = setTimeout(function () {
+      page = 1;
+      search(false);
+    }, 250);
+  });
+
+  moreButton.addEventListener('click', function () {
+    page += 1;
+    search(true);
+  });
+
+  // Show the players posted with the form, e.g. when the form is rendered again with validation errors.
+  const playerIds = playerIdsInput.value.split(',').filter(Boolean);
+  if (playerIds.length > 0) {
+    fetchPlayers({ids: playerIds.join(','), per_page: maxPlayers}).then(function (data) {
+      data.players.forEach(function (player) {
+        selected.set(player.player_id, player);
+      });
+      renderSelected();
+    }).catch(console.error);
+  }
+
+});
@@ -0,0 +1,252 @@
+import os
+import re
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from typing import List, Dict
+
+from data import PlayerTable, ROUND_STATS_COLUMNS
+
+VALUE_HISTORY_DIR = os.environ.get(
+    'VALUE_HISTORY_DIR', os.path.join(tempfile.gettempdir(), 'holdet-optimizer-value-history')
+)
+"""Directory of the value histories, one subdirectory per game."""
+
+CHUNK_FILE_PATTERN = re.compile(r"^(\d+)-(\d+)\.npz$")
+
+CHUNK_DTYPES = {column: np.float32 if column == 'popularity' else np.float64 for column in ROUND_STATS_COLUMNS}
+"""Storage type of each round statistics column. Values are floats, as players without statistics are NaN."""
+
+
+class ValueHistoryChunk:
+    """One snapshot of the Holdet round statistics: a column per ROUND_STATS_COLUMNS, sorted by player_id, which is
+    the index used to look up players."""
+
+    def __init__(self, round_number: int, timestamp: float, columns: Dict[str, np.ndarray]):
+        self.round_number = round_number
+        self.timestamp = timestamp
+        self.columns = columns
+        self.player_ids = columns['player_id']
+
+    def rows_of(self, player_ids: np.ndarray) -> (np.ndarray, np.ndarray):
+        """Return the rows of the given player IDs and a mask of the players found in the chunk."""
+
+        if len(self.player_ids) == 0:
+            return np.zeros(len(player_ids), dtype=np.int64), np.zeros(len(player_ids), dtype=bool)
+        rows = np.minimum(np.searchsorted(self.player_ids, player_ids), len(self.player_ids) - 1)
+        return rows, self.player_ids[rows] == player_ids
+
+    def values_of(self, column: str, player_ids: np.ndarray) -> np.ndarray:
+        """Return the column values of the given player IDs, NaN for players not in the chunk."""
+
+        rows, found = self.rows_of(player_ids)
+        return np.where(found, self.columns[column][rows], np.nan)
+
+
+class ValueHistory:
+    """Append-only time series of the Holdet round statistics (values, growth and popularity) of a game. Every
+    snapshot is stored as a columnar chunk in a directory per round, named by its timestamp, so range queries only
+    read the chunks of the rounds and times asked for. A snapshot equal to the latest of its round is not stored.
+    Only the latest chunk of each round is kept in memory, as the forecast and the appends read only those."""
+
+    def __init__(self, name: str, directory: str = VALUE_HISTORY_DIR):
+        self.directory = os.path.join(directory, name)
+        self._latest_chunks = {}
+        self._lock = threading.Lock()
+
+    def _round_directory(self, round_number: int) -> str:
+        return os.path.join(self.directory, f"round_{round_number:03d}")
+
+    def get_rounds(self) -> List[int]:
+        """Return the round numbers with snapshots, in order."""
+
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            int(name.replace('round_', '')) for name in os.listdir(self.directory) if name.startswith('round_')
+        )
+
+    def _get_chunk_paths(self, round_number: int, start_time: float = None, end_time: float = None) -> List[str]:
+        """Return the chunk files of a round in time order, optionally only those within [start_time, end_time]."""
+
+        round_directory = self._round_directory(round_number)
+        if not os.path.isdir(round_directory):
+            return []
+        chunks = []
+        for file_name in os.listdir(round_directory):
+            match = CHUNK_FILE_PATTERN.match(file_name)
+            if match is None:
+                continue
+            timestamp = int(match.group(1)) / 1e9
+            if (start_time is None or timestamp >= start_time) and (end_time is None or timestamp <= end_time):
+                chunks.append((int(match.group(1)), os.path.join(round_directory, file_name)))
+        return [path for _, path in sorted(chunks)]
+
+    @staticmethod
+    def _read_chunk(path: str) -> ValueHistoryChunk:
+        with np.load(path) as arrays:
+            columns = {name: arrays[name] for name in arrays.files if name not in ('round', 'timestamp')}
+            return ValueHistoryChunk(int(arrays['round']), float(arrays['timestamp']), columns)
+
+    def get_latest_chunk(self, round_number: int) -> ValueHistoryChunk | None:
+        """Return the latest chunk of a round, read only if another process has appended since it was last read."""
+
+        paths = self._get_chunk_paths(round_number)
+        if len(paths) == 0:
+            return None
+        with self._lock:
+            latest = self._latest_chunks.get(round_number)
+        if latest is None or latest[0] != paths[-1]:
+            latest = (paths[-1], self._read_chunk(paths[-1]))
+            with self._lock:
+                self._latest_chunks[round_number] = latest
+        return latest[1]
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint of the chunks kept in memory in bytes."""
+
+        with self._lock:
+            chunks = [chunk for _, chunk in self._latest_chunks.values()]
+        return sum(column.nbytes for chunk in chunks for column in chunk.columns.values())
+
+    def append(self, round_number: int, players: PlayerTable, timestamp: float = None) -> str | None:
+        """Store a snapshot of the round statistics of the players. Returns the chunk file path, or None if the
+        snapshot equals the latest snapshot of the round."""
+
+        timestamp = time.time() if timestamp is None else timestamp
+        order = np.argsort(players.column('player_id'), kind='stable')
+        columns = {'player_id': players.column('player_id')[order].astype(np.int64)}
+        for column, dtype in CHUNK_DTYPES.items():
+            columns[column] = pd.to_numeric(players.column(column)[order], errors='coerce').astype(dtype)
+
+        latest = self.get_latest_chunk(round_number)
+        if latest is not None and all(
+                np.array_equal(latest.columns[column], values, equal_nan=column != 'player_id')
+                for column, values in columns.items()
+        ):
+            return None
+
+        round_directory = self._round_directory(round_number)
+        os.makedirs(round_directory, exist_ok=True)
+        path = os.path.join(round_directory, f"{int(timestamp * 1e9)}-{os.getpid()}.npz")
+        # Written to a temporary file first, so other processes never read a partial chunk.
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(f, round=round_number, timestamp=timestamp, **columns)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._latest_chunks[round_number] = (path, ValueHistoryChunk(round_number, timestamp, columns))
+        return path
+
+    def query(
+            self,
+            player_ids: List[int] = None,
+            start_round: int = None,
+            end_round: int = None,
+            start_time: float = None,
+            end_time: float = None
+    ) -> pd.DataFrame:
+        """Return the snapshots of the rounds [start_round, end_round] taken within [start_time, end_time] (Unix
+        times), one row per snapshot and player, optionally only of the given players. All bounds are optional."""
+
+        if player_ids is not None:
+            player_ids = np.asarray(sorted(set(player_ids)), dtype=np.int64)
+        frames = []
+        for round_number in self.get_rounds():
+            if (start_round is not None and round_number < start_round) or \
+                    (end_round is not None and round_number > end_round):
+                continue
+            for path in self._get_chunk_paths(round_number, start_time, end_time):
+                chunk = self._read_chunk(path)
+                if player_ids is None:
+                    columns = chunk.columns
+                else:
+                    rows, found = chunk.rows_of(player_ids)
+                    rows = rows[found]
+                    columns = {column: values[rows] for column, values in chunk.columns.items()}
+                frame = pd.DataFrame(columns)
+                frame.insert(0, 'timestamp', pd.to_datetime(chunk.timestamp, unit='s', utc=True))
+                frame.insert(0, 'round', round_number)
+                frames.append(frame)
+        if len(frames) == 0:
+            return pd.DataFrame(columns=['round', 'timestamp', 'player_id', *CHUNK_DTYPES])
+        return pd.concat(frames, ignore_index=True)
+
+    def get_round_values(
+            self,
+            player_ids: np.ndarray,
+            column: str = 'current_value',
+            end_round: int = None
+    ) -> (List[int], np.ndarray):
+        """Return the rounds up to end_round and a (players, rounds) matrix of the column values of the given players
+        in the latest snapshot of each round, NaN where a player has no value."""
+
+        player_ids = np.asarray(player_ids, dtype=np.int64)
+        rounds = [round_number for round_number in self.get_rounds() if end_round is None or round_number <= end_round]
+        values = np.full((len(player_ids), len(rounds)), np.nan)
+        for j, round_number in enumerate(rounds):
+            chunk = self.get_latest_chunk(round_number)
+            if chunk is not None:
+                values[:, j] = chunk.values_of(column, player_ids)
+        return rounds, values
+
+    def forecast_value_change(
+            self,
+            player_ids: np.ndarray,
+            end_round: int = None,
+            window: int = 5,
+            halflife: float = 2.0
+    ) -> np.ndarray:
+        """Forecast the value change of the given players in the next round as the exponentially weighted mean of their
+        value changes between the latest snapshots of the last window rounds up to end_round, weighting a round
+        halflife rounds back half as much as the latest. Players without a value change in the window get 0."""
+
+        rounds, values = self.get_round_values(player_ids, 'current_value', end_round)
+        changes = np.diff(values[:, -(window + 1):], axis=1)
+        if changes.shape[1] == 0:
+            return np.zeros(len(player_ids))
+        weights = 0.5 ** (np.arange(changes.shape[1])[::-1] / halflife)
+        known = ~np.isnan(changes)
+        weight_sums = (known * weights).sum(axis=1)
+        weighted_sums = (np.where(known, changes, 0) * weights).sum(axis=1)
+        return np.divide(weighted_sums, weight_sums, out=np.zeros(len(player_ids)), where=weight_sums > 0)
+
+
+def import_recorded_rounds(history: ValueHistory, rounds_dir: str) -> int:
+    """Backfill a value history from recorded rounds (see backtest.record_round), one snapshot per round at the round
+    close time. Returns the number of snapshots stored."""
+
+    from backtest import get_round_paths, load_round
+
+    stored = 0
+    for path in get_round_paths(rounds_dir):
+        holdet, _ = load_round(path)
+        round_close = holdet.game_data['rounds'][holdet.round_number - 1]['close']
+        timestamp = pd.Timestamp(round_close).timestamp()
+        stored += history.append(holdet.round_number, holdet.player_data, timestamp=timestamp) is not None
+    return stored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import recorded rounds into a value history and show the forecast.")
+    parser.add_argument("rounds_dir", help="Directory of recorded round files (round_<number>.json).")
+    parser.add_argument("--game-id", type=int, required=True, help="Holdet game ID of the recorded rounds.")
+    parser.add_argument("--top", type=int, default=20, help="Number of players with the highest forecast to show.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    value_history = ValueHistory(f"game_{args.game_id}")
+    print(f"Stored {import_recorded_rounds(value_history, args.rounds_dir)} snapshots for rounds "
+          f"{value_history.get_rounds()}.")
+    latest_round = value_history.get_rounds()[-1]
+    latest_ids = value_history.get_latest_chunk(latest_round).player_ids
+    forecast = pd.DataFrame({
+        'player_id': latest_ids,
+        'expected_value_growth': value_history.forecast_value_change(latest_ids),
+    })
+    print(forecast.sort_values('expected_value_growth', ascending=False).head(args.top).to_string(index=False))